@@ -0,0 +1,105 @@
+"""
+Background item anchor refresh.
+
+Item anchors (item_anchors, see routers/route.py `refresh_item_anchors`) depend
+on the segment network and the item positions, so segment and item writes have
+to recompute some of them. Snapping a whole mart is real work: a shared segment
+(mart_id NULL, what the AdminDashboard draws) touches every item of every mart.
+Write endpoints therefore only `schedule` the refresh after their commit and
+return; one in-process task per uvicorn worker drains the queue with its own
+session, merging the requests that pile up meanwhile. A failed refresh is
+logged and never reaches the write that asked for it.
+
+Until the refresh has run, routes keep working: an anchor whose segment piece
+is gone from the graph is ignored and the item is snapped per request, and
+item writes that move an item delete its old anchor in their own transaction.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Iterable, List, Optional, Set
+
+from sqlalchemy.exc import IntegrityError
+
+from database import async_session_factory
+from routers.route import refresh_item_anchors
+
+log = logging.getLogger(__name__)
+
+# queued scopes: mart ids (None = every mart) and single items
+_marts: Set[Optional[int]] = set()
+_items: Set[int] = set()
+_task: Optional[asyncio.Task] = None
+
+
+def schedule(mart_id: Optional[int] = None, item_ids: Optional[Iterable[int]] = None) -> None:
+    """
+    Queue a refresh of the given items, or of every item in a mart (every item
+    when both are None), like refresh_item_anchors. Call after the commit.
+    """
+    global _task
+    if item_ids is not None:
+        _items.update(item_ids)
+    else:
+        _marts.add(mart_id)
+    if _task is None or _task.done():
+        _task = asyncio.get_running_loop().create_task(_drain())
+
+
+async def _refresh(marts: Set[Optional[int]], items: List[int]) -> None:
+    async with async_session_factory() as db:
+        if None in marts:
+            await refresh_item_anchors(db)
+            return
+        for mart_id in sorted(marts):
+            await refresh_item_anchors(db, mart_id=mart_id)
+        if items:
+            await refresh_item_anchors(db, item_ids=items)
+
+
+async def _drain() -> None:
+    while _marts or _items:
+        marts, items = set(_marts), sorted(_items)
+        _marts.clear()
+        _items.clear()
+        for attempt in (1, 2):
+            try:
+                await _refresh(marts, items)
+            except asyncio.CancelledError:
+                raise
+            except IntegrityError:
+                # an item or segment was deleted while its anchor was computed
+                # (e.g. a mart delete): once more over what is left
+                if attempt == 1:
+                    continue
+                log.exception("item anchor refresh failed")
+            except Exception:
+                log.exception("item anchor refresh failed")
+            break
+
+
+async def wait() -> None:
+    """Wait until the queue is empty (scripts and tests)."""
+    while _task is not None and not _task.done():
+        await asyncio.shield(_task)
+
+
+async def stop(grace: float = 5.0) -> None:
+    """
+    Let the queued refresh finish (up to `grace` seconds) before cancelling it,
+    so shutdown does not cut a refresh off in the middle of its transaction.
+    """
+    global _task
+    if _task is None:
+        return
+    try:
+        await asyncio.wait_for(asyncio.shield(_task), grace)
+    except asyncio.TimeoutError:
+        pass
+    _task.cancel()
+    try:
+        await _task
+    except asyncio.CancelledError:
+        pass
+    _task = None
@@ -0,0 +1,209 @@
+"""
+Routing micro-benchmarks over synthetic stores.
+
+Times the pieces of routers/route.py that dominate a route request: graph
+building (`_build_graph`, `_connect_nearby_nodes`, the full `_compile_graph`),
+endpoint snapping, point-to-point Dijkstra vs A*, and multi-stop planning.
+
+    python -m bench.route_bench                      # print timings
+    python -m bench.route_bench --save               # write bench/baseline.json
+    python -m bench.route_bench --check              # compare with the baseline, exit 1 on regressions
+    python -m bench.route_bench --check --max-regression 1.0 --stores grid,random
+
+Each timing is the best of --repeat runs, in milliseconds (per call for
+snapping and searches). Baselines are machine specific, so none is committed
+(bench/baseline.json is git-ignored): --check refuses to run until --save has
+recorded one with the same Python version and machine type.
+
+Timings vary from run to run by more than the repeats inside one run smooth
+out (readme.MD section 7 has measured numbers), so --check re-runs a store
+that looks regressed up to --confirm times and judges each metric by its best
+time over those runs; the default --max-regression of 0.5 assumes that.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from typing import Callable, Dict, List
+
+from bench import stores
+from routers import route as R
+from tour_optimizer import solve_path
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+STORES: Dict[str, Callable[[], List[stores.Polyline]]] = {
+    "grid": stores.grid_aisles,
+    "random": stores.random_polylines,
+    "hypermarket": stores.hypermarket,
+}
+
+SNAP_EPS = 20.0
+SNAP_POINTS = 500
+QUERIES = 30
+PLAN_STOPS = 20
+
+
+def _best(fn: Callable[[], object], repeat: int, per: int = 1) -> float:
+    """Best wall time of `repeat` runs of fn, in ms, divided by `per` calls."""
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000.0 / per
+
+
+def bench_store(polylines: List[stores.Polyline], repeat: int) -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    out["build_graph_ms"] = _best(lambda: R._build_graph(polylines), repeat)
+
+    def connect():
+        graph, coords = R._build_graph(polylines)
+        t0 = time.perf_counter()
+        R._connect_nearby_nodes(graph, coords, eps=SNAP_EPS)
+        return time.perf_counter() - t0
+    out["connect_nearby_ms"] = min(connect() for _ in range(repeat)) * 1000.0
+
+    out["compile_ms"] = _best(lambda: R._compile_graph(polylines, SNAP_EPS), repeat)
+    compiled = R._compile_graph(polylines, SNAP_EPS)
+    box = stores.bounds_of(polylines)
+
+    points = stores.random_points(SNAP_POINTS, box, seed=5)
+    out["snap_ms"] = _best(lambda: [compiled.index.nearest_segment(p) for p in points], repeat, len(points))
+
+    ends = stores.random_points(2 * QUERIES, box, seed=6)
+    pairs = list(zip(ends[::2], ends[1::2]))
+    for algo in ("dijkstra", "astar"):
+        out[f"{algo}_ms"] = _best(
+            lambda: [R._shortest_polyline_between(s, e, compiled, algorithm=algo) for s, e in pairs],
+            repeat, len(pairs))
+
+    # string keys keep the item leg cache out of the measurement
+    stops = stores.random_points(PLAN_STOPS + 1, box, seed=7)
+    pos = {f"s{i}": p for i, p in enumerate(stops)}
+    keys = list(pos)
+
+    def plan():
+        legs = R._network_legs(compiled, pos, [(a, b) for a in keys for b in keys])
+        dist = [[legs[(a, b)][0] for b in keys] for a in keys]
+        return solve_path(dist, 0)
+    out["plan_ms"] = _best(plan, repeat)
+    return out
+
+
+def run(names: List[str], repeat: int) -> Dict[str, float]:
+    results: Dict[str, float] = {}
+    for name in names:
+        polylines = STORES[name]()
+        segs = sum(len(pl) - 1 for pl in polylines)
+        print(f"{name}: {len(polylines)} polylines, {segs} segments", flush=True)
+        for metric, ms in bench_store(polylines, repeat).items():
+            results[f"{name}.{metric}"] = round(ms, 4)
+            print(f"  {metric:<20} {ms:10.3f}", flush=True)
+    return results
+
+
+def confirm(names: List[str], results: Dict[str, float], repeat: int) -> Dict[str, float]:
+    """Run the stores again and keep each metric's best time over both runs."""
+    again = run(names, repeat)
+    return {k: min(ms, again.get(k, ms)) for k, ms in results.items()}
+
+
+def check(results: Dict[str, float], baseline: Dict[str, float], max_regression: float, min_delta_ms: float) -> List[str]:
+    """Metrics slower than baseline * (1 + max_regression) by more than min_delta_ms."""
+    failed: List[str] = []
+    for key, ms in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        if ms > base * (1.0 + max_regression) and ms - base > min_delta_ms:
+            failed.append(f"{key}: {ms:.3f} ms vs baseline {base:.3f} ms (+{(ms / base - 1.0) * 100:.0f}%)")
+    return failed
+
+
+def _meta() -> Dict[str, str]:
+    """What a baseline must share with the run that checks against it."""
+    return {"python": platform.python_version(), "machine": platform.machine()}
+
+
+def _load_baseline(path: str) -> Dict[str, float]:
+    """Results of a baseline saved on this machine; ValueError with the reason otherwise."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        results, meta = data["results"], data.get("meta", {})
+    except FileNotFoundError:
+        raise ValueError(f"no baseline at {path}")
+    except (OSError, ValueError, KeyError) as e:
+        raise ValueError(f"cannot read baseline {path}: {e}")
+    here = _meta()
+    other = [f"{k} {meta.get(k)} != {v}" for k, v in here.items() if meta.get(k) != v]
+    if other:
+        raise ValueError(f"baseline {path} was recorded elsewhere ({', '.join(other)})")
+    return results
+
+
+def main(argv: List[str] = None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--stores", default=",".join(STORES), help="comma separated: " + ", ".join(STORES))
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--save", action="store_true", help="write the results as the new baseline")
+    ap.add_argument("--check", action="store_true", help="fail when a metric regressed against the baseline")
+    ap.add_argument("--baseline", default=BASELINE)
+    ap.add_argument("--max-regression", type=float, default=0.5, help="allowed slowdown as a fraction (0.5 = 50%%)")
+    ap.add_argument("--min-delta-ms", type=float, default=0.05, help="ignore slowdowns smaller than this")
+    ap.add_argument("--confirm", type=int, default=2, help="re-runs of a store that looks regressed before failing")
+    args = ap.parse_args(argv)
+
+    names = [n.strip() for n in args.stores.split(",") if n.strip()]
+    unknown = [n for n in names if n not in STORES]
+    if unknown:
+        ap.error(f"unknown store(s): {', '.join(unknown)}")
+    baseline: Dict[str, float] = {}
+    if args.check:
+        # before the (slow) run: a foreign or missing baseline makes the check meaningless
+        try:
+            baseline = _load_baseline(args.baseline)
+        except ValueError as e:
+            print(f"{e}; run `python -m bench.route_bench --save` on this machine first", file=sys.stderr)
+            return 2
+    results = run(names, max(args.repeat, 1))
+
+    if args.check:
+        failed = check(results, baseline, args.max_regression, args.min_delta_ms)
+        for _ in range(max(args.confirm, 0)):
+            if not failed:
+                break
+            suspects = sorted({line.split(".", 1)[0] for line in failed})
+            print(f"re-running {', '.join(suspects)} to confirm", flush=True)
+            results = confirm(suspects, results, max(args.repeat, 1))
+            failed = check(results, baseline, args.max_regression, args.min_delta_ms)
+        for line in failed:
+            print("REGRESSION " + line, file=sys.stderr)
+        if failed:
+            return 1
+        print(f"no regressions beyond {args.max_regression:.0%}")
+    if args.save:
+        data = {
+            "meta": {**_meta(), "repeat": args.repeat},
+            "results": results,
+        }
+        try:
+            # keep metrics of stores that were not run this time (from this machine only)
+            data["results"] = {**_load_baseline(args.baseline), **results}
+        except ValueError:
+            pass
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"baseline written to {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
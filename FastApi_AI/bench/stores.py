@@ -0,0 +1,82 @@
+"""
+Synthetic store layouts for the routing benchmarks.
+
+Every generator is deterministic for a given seed and returns polylines in map
+pixels, shaped like what the AdminDashboard saves into `segments`.
+"""
+from __future__ import annotations
+
+import random
+from typing import List, Tuple
+
+Point = Tuple[float, float]
+Polyline = List[Point]
+
+
+def grid_aisles(nx: int = 12, ny: int = 10, w: float = 1600, h: float = 1200,
+                jitter: float = 3.0, seed: int = 1) -> List[Polyline]:
+    """
+    Regular supermarket: nx vertical and ny horizontal aisles drawn as one
+    polyline each, with a little hand-drawing jitter so crossings are not exact.
+    """
+    rnd = random.Random(seed)
+    j = lambda: rnd.uniform(-jitter, jitter)
+    out: List[Polyline] = []
+    for i in range(nx):
+        x = w * i / (nx - 1)
+        out.append([(x + j(), h * k / (ny - 1) + j()) for k in range(ny)])
+    for k in range(ny):
+        y = h * k / (ny - 1)
+        out.append([(w * i / (nx - 1) + j(), y + j()) for i in range(nx)])
+    return out
+
+
+def random_polylines(n: int = 300, w: float = 1600, h: float = 1200,
+                     max_points: int = 4, seed: int = 2) -> List[Polyline]:
+    """Free-drawn walkways: n random polylines of 2..max_points points."""
+    rnd = random.Random(seed)
+    out: List[Polyline] = []
+    for _ in range(n):
+        x, y = rnd.uniform(0, w), rnd.uniform(0, h)
+        pl = [(x, y)]
+        for _ in range(rnd.randint(1, max_points - 1)):
+            x = min(max(x + rnd.uniform(-200, 200), 0.0), w)
+            y = min(max(y + rnd.uniform(-200, 200), 0.0), h)
+            pl.append((x, y))
+        out.append(pl)
+    return out
+
+
+def hypermarket(aisles: int = 60, bays: int = 180, cross_every: int = 15,
+                bay_len: float = 40.0, aisle_gap: float = 60.0, seed: int = 3) -> List[Polyline]:
+    """
+    Hypermarket-scale floor: `aisles` long aisles drawn bay by bay (one
+    two-point segment per shelf bay, as admins trace them), joined by cross
+    aisles every `cross_every` bays. The defaults give ~12k segments.
+    """
+    rnd = random.Random(seed)
+    j = lambda: rnd.uniform(-1.0, 1.0)
+    out: List[Polyline] = []
+    length = bays * bay_len
+    for a in range(aisles):
+        y = a * aisle_gap
+        pts = [(b * bay_len + j(), y + j()) for b in range(bays + 1)]
+        out.extend([pts[b], pts[b + 1]] for b in range(bays))
+    for b in range(0, bays + 1, cross_every):
+        x = min(b * bay_len, length)
+        ys = [a * aisle_gap for a in range(aisles)]
+        out.extend([(x + j(), ys[a] + j()), (x + j(), ys[a + 1] + j())] for a in range(aisles - 1))
+    return out
+
+
+def random_points(n: int, bounds: Tuple[float, float, float, float], seed: int = 4) -> List[Point]:
+    """n query points uniformly inside (x0, y0, x1, y1)."""
+    rnd = random.Random(seed)
+    x0, y0, x1, y1 = bounds
+    return [(rnd.uniform(x0, x1), rnd.uniform(y0, y1)) for _ in range(n)]
+
+
+def bounds_of(polylines: List[Polyline]) -> Tuple[float, float, float, float]:
+    xs = [p[0] for pl in polylines for p in pl]
+    ys = [p[1] for pl in polylines for p in pl]
+    return min(xs), min(ys), max(xs), max(ys)
@@ -0,0 +1,145 @@
+"""
+Catalog content versions and conditional GETs.
+
+Every write endpoint that changes what a mart's catalog reads return (items,
+categories, segments, paths, the mart row itself) calls `bump` before its
+commit. `bump` advances the single-row `catalog_clock` and stamps the new value
+into `marts.content_version` of the marts concerned, so each mart's version only
+ever grows and the clock is the version of "everything".
+
+The writes also stamp that version on the rows they touch (`content_version`
+of items, categories and segments) and record deleted rows with `bury`, which
+is what /api/marts/{id}/changes reads.
+
+Writes that change the walkable network (segments, a mart's snap settings, the
+mart row itself) pass `routing=True`, which also stamps the version into
+`route_version`. The route caches in graph_cache.py key on these two numbers
+(`route_versions`), so like the ETags they agree across uvicorn workers and
+replicas.
+
+Read endpoints take `Depends(conditional("items"))`: it reads one version (the
+mart's when the request has a mart_id, else the clock), answers a matching
+If-None-Match with 304 before the endpoint runs its catalog query, and otherwise
+sets ETag / Cache-Control on the response. The version is read before the
+catalog rows, so a write racing with the read can only make the ETag older than
+the body, which costs the client one extra download, never a stale 304.
+"""
+from __future__ import annotations
+
+import hashlib
+from typing import Any, Awaitable, Callable, Iterable, Optional, Tuple, Union
+
+from fastapi import Depends, HTTPException, Request, Response
+from sqlalchemy import insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import get_db
+from models import CatalogClock, CatalogTombstone, Mart
+
+# clients may keep responses but must revalidate them (cheap with If-None-Match)
+CACHE_CONTROL = "no-cache"
+
+# Session.info key of the route versions read by this session (see route_versions)
+_ROUTE_VERSIONS = "catalog_version.route_versions"
+
+
+async def bump(db: AsyncSession, mart_ids: Union[int, Iterable[Optional[int]], None], routing: bool = False) -> int:
+    """
+    Advance the clock and stamp it on the given mart(s); None (or a None among
+    them, i.e. a row shared by all marts) stamps every mart. With routing=True the
+    route_version of the clock and the marts moves too. Call inside the write's
+    transaction, before commit. Returns the new version.
+    """
+    db.info.pop(_ROUTE_VERSIONS, None)
+    values = {"version": CatalogClock.version + 1}
+    if routing:
+        values["route_version"] = CatalogClock.version + 1
+    res = await db.execute(
+        update(CatalogClock).where(CatalogClock.id == 1)
+        .values(**values)
+        .returning(CatalogClock.version)
+    )
+    version = res.scalar_one_or_none()
+    if version is None:
+        await db.execute(insert(CatalogClock).values(id=1, version=1, route_version=1 if routing else 0))
+        version = 1
+    ids = [mart_ids] if mart_ids is None or isinstance(mart_ids, int) else list(mart_ids)
+    stamp = {"content_version": version}
+    if routing:
+        stamp["route_version"] = version
+    stmt = update(Mart).values(**stamp).execution_options(synchronize_session=False)
+    if None not in ids:
+        stmt = stmt.where(Mart.id.in_(ids))
+    await db.execute(stmt)
+    return version
+
+
+def bury(db: AsyncSession, kind: str, object_id: int, mart_id: Optional[int], version: int) -> None:
+    """Record that an item/category/segment left `mart_id` (deleted or moved) at `version`."""
+    db.add(CatalogTombstone(mart_id=mart_id, kind=kind, object_id=object_id, content_version=version))
+
+
+async def current(db: AsyncSession, mart_id: Optional[int] = None) -> Optional[int]:
+    """Content version of a mart (None if it does not exist), or the clock when mart_id is None."""
+    if mart_id is not None:
+        return (await db.execute(select(Mart.content_version).where(Mart.id == mart_id))).scalar_one_or_none()
+    return (await db.execute(select(CatalogClock.version).where(CatalogClock.id == 1))).scalar_one_or_none() or 0
+
+
+async def route_versions(db: AsyncSession, mart_id: Optional[int] = None) -> Tuple[int, int]:
+    """
+    (route_version, content_version) of a mart, or of the clock when mart_id is
+    None; (0, 0) for a mart that does not exist. Read once per session (a request)
+    and remembered there until the next `bump`, so a route request costs one SELECT.
+    """
+    seen = db.info.setdefault(_ROUTE_VERSIONS, {})
+    if mart_id not in seen:
+        if mart_id is not None:
+            stmt = select(Mart.route_version, Mart.content_version).where(Mart.id == mart_id)
+        else:
+            stmt = select(CatalogClock.route_version, CatalogClock.version).where(CatalogClock.id == 1)
+        row = (await db.execute(stmt)).first()
+        seen[mart_id] = (row[0], row[1]) if row is not None else (0, 0)
+    return seen[mart_id]
+
+
+def _matches(if_none_match: str, etag: str) -> bool:
+    # weak comparison (RFC 9110 13.1.2)
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or any(t.removeprefix("W/") == etag.removeprefix("W/") for t in tags)
+
+
+def _int_param(request: Request, name: str) -> Optional[int]:
+    raw = request.path_params.get(name, request.query_params.get(name))
+    try:
+        return int(raw) if raw is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def conditional(kind: str, extra: Optional[Callable[[AsyncSession, Optional[int]], Awaitable[Any]]] = None):
+    """
+    Dependency adding ETag / Cache-Control to a catalog read and answering
+    If-None-Match with 304. `extra(db, mart_id)` is folded into the tag when the
+    body also depends on something the version does not track (e.g. the clock).
+    """
+
+    async def check(request: Request, response: Response, db: AsyncSession = Depends(get_db)) -> None:
+        mart_id = _int_param(request, "mart_id")
+        version = await current(db, mart_id)
+        if version is None:
+            return  # unknown mart: let the endpoint answer (404 or empty list)
+        # the query string is part of the tag: fields/limit/after_id give different bodies
+        key = str(request.url.query)
+        if extra is not None:
+            # read before the rows too, so it can only lag the body
+            key += f"|{await extra(db, mart_id)}"
+        digest = hashlib.blake2s(key.encode(), digest_size=6).hexdigest()
+        etag = f'W/"{kind}-{mart_id if mart_id is not None else "all"}-{version}-{digest}"'
+        headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+        inm = request.headers.get("if-none-match")
+        if inm and _matches(inm, etag):
+            raise HTTPException(status_code=304, headers=headers)
+        response.headers.update(headers)
+
+    return check
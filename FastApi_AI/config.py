@@ -1,7 +1,7 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import Field
 import json
-from typing import List, Optional
+from typing import Dict, List, Optional
 import os
 
 
@@ -50,6 +50,36 @@ class Settings(BaseSettings):
     CLOUDINARY_API_SECRET: Optional[str] = None
     CLOUDINARY_FOLDER: str = Field(default="store-nav")
 
+    # Routing: default gap (map pixels) bridged between nearly-touching segment
+    # nodes; a mart can override it with marts.route_snap_eps
+    ROUTE_SNAP_EPS: float = Field(default=20.0)
+    # Time budget for improving the stop order of large /route/plan requests
+    ROUTE_PLAN_TIME_BUDGET_MS: int = Field(default=200)
+    # Landmarks precomputed per compiled graph for the A* (ALT) heuristic; 0 disables
+    ROUTE_ALT_LANDMARKS: int = Field(default=8)
+    # Multi-floor routing: walking-distance equivalent (map units) of moving one
+    # floor (one unit of z) with each connector item type
+    ROUTE_FLOOR_TRANSFER_COST: Dict[str, float] = Field(
+        default={"elevator": 60.0, "escalator": 40.0, "stairs": 80.0}
+    )
+    # Destination-rooted shortest-path trees kept per compiled graph for re-routing; 0 disables
+    ROUTE_DEST_TREES: int = Field(default=64)
+    # Compiled graphs, floor plans and path graphs kept per worker (least recently used dropped first)
+    ROUTE_GRAPH_CACHE: int = Field(default=64)
+    # Where graph builds and searches run: "thread" or "process" pool, or "none" (on the event loop)
+    ROUTE_POOL: str = Field(default="thread")
+    # Pool size; 0 = executor default (CPU count based)
+    ROUTE_POOL_WORKERS: int = Field(default=0)
+    # Decimals kept by encoding='polyline' route responses (clients decode with the same value)
+    ROUTE_POLYLINE_PRECISION: int = Field(default=2)
+
+    # Seconds between background runs clearing expired item sales; 0 disables
+    SALE_EXPIRY_INTERVAL_SEC: int = Field(default=60)
+
+    # Apply pending schema migrations (migrations.py) when a worker starts; when
+    # false, run `python -m migrations` before starting the server
+    DB_MIGRATE_ON_STARTUP: bool = Field(default=True)
+
     # Resolve env file: prefer .env, fall back to .env.sample (both relative to this file)
     _base_dir = os.path.dirname(os.path.abspath(__file__))
     _env_primary = os.path.join(_base_dir, ".env")
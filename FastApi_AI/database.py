@@ -1,3 +1,4 @@
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 from config import settings
@@ -10,6 +11,15 @@ engine = create_async_engine(
     future=True,
 )
 
+if settings.is_sqlite:
+    # SQLite enforces foreign keys (ON DELETE CASCADE / SET NULL) only on
+    # connections that ask for it, so every pooled connection does
+    @event.listens_for(engine.sync_engine, "connect")
+    def _sqlite_foreign_keys(dbapi_conn, _record):
+        cursor = dbapi_conn.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
 async_session_factory = sessionmaker(
     engine,
     class_=AsyncSession,
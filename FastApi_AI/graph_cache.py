@@ -0,0 +1,85 @@
+"""
+In-process cache for compiled navigation graphs.
+
+Building the walkable graph (segment intersection splitting + near-node
+bridging) is by far the most expensive part of a route request, while the
+underlying segments only change when an admin edits the map. Compiled graphs
+(and the item graph built from the paths table) are kept in memory and tagged
+with the version that was current when their rows were read.
+
+The versions are not kept here: they are the database's `route_version` /
+`content_version` of the mart (or of `catalog_clock` for mart-less routes, see
+catalog_version.py), which every write endpoint advances. A lookup passes the
+version it just read, so a write served by one uvicorn worker makes the
+entries of every other worker miss on their next request too.
+
+At most ROUTE_GRAPH_CACHE entries are kept, least recently used first out.
+`get_or_build` builds a missing graph once: concurrent requests that miss the
+same key and version await that one build instead of compiling their own.
+"""
+from __future__ import annotations
+
+import asyncio
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from config import settings
+
+# scope key (mart id, or None for all segments; tuples for other graphs) -> (version, graph)
+_entries: "OrderedDict[Hashable, Tuple[Any, Any]]" = OrderedDict()
+# (key, version) -> future of the build in progress
+_building: Dict[Tuple[Hashable, Any], asyncio.Future] = {}
+
+
+def get_graph(key: Hashable, version: Any) -> Optional[Any]:
+    """Return the cached graph for `key` if it was built at `version`, else None."""
+    entry = _entries.get(key)
+    if entry is None or entry[0] != version:
+        return None
+    _entries.move_to_end(key)
+    return entry[1]
+
+
+def put_graph(key: Hashable, version: Any, graph: Any) -> None:
+    """
+    Store a graph under the version read *before* its rows were loaded. If a
+    write raced with the build the entry is already older than the database and
+    is simply rebuilt on the next lookup.
+    """
+    _entries[key] = (version, graph)
+    _entries.move_to_end(key)
+    while len(_entries) > max(settings.ROUTE_GRAPH_CACHE, 1):
+        _entries.popitem(last=False)
+
+
+async def get_or_build(key: Hashable, version: Any, build: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    The cached graph for `key` at `version`, or the result of `build()` (then
+    cached). While one build runs, other callers for the same key and version
+    wait for it; if it fails or its request goes away they build themselves.
+    """
+    while True:
+        cached = get_graph(key, version)
+        if cached is not None:
+            return cached
+        pending = _building.get((key, version))
+        if pending is None:
+            break
+        try:
+            return await asyncio.shield(pending)
+        except asyncio.CancelledError:
+            if not pending.cancelled():
+                raise  # this caller was cancelled, not the build
+    future = asyncio.get_running_loop().create_future()
+    _building[(key, version)] = future
+    try:
+        graph = await build()
+    except BaseException:
+        # waiters retry with their own build (and get their own error)
+        future.cancel()
+        raise
+    finally:
+        _building.pop((key, version), None)
+    put_graph(key, version, graph)
+    future.set_result(graph)
+    return graph
@@ -0,0 +1,93 @@
+"""
+Keyset pagination and field projection for the catalog list endpoints.
+
+`after_id` / `limit` page by primary key (`WHERE id > :after_id ORDER BY id
+LIMIT :limit`), which stays an index range scan however deep the client pages.
+A full page sets `X-Next-After-Id` to the last id, so the next page is
+`?after_id=<X-Next-After-Id>`; a short page has no header and is the last one.
+Without `limit` the endpoints keep returning every row.
+
+`fields=id,x,y` makes an endpoint select only the columns behind those
+response fields, and its rows then carry only those keys (`id` always).
+"""
+
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Type
+
+from fastapi import HTTPException, Query, Response
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, create_model
+
+MAX_PAGE_SIZE = 1000
+NEXT_HEADER = "X-Next-After-Id"
+
+
+class Page:
+    """after_id / limit / fields query parameters (use as `page: Page = Depends()`)."""
+
+    def __init__(
+        self,
+        after_id: Optional[int] = Query(default=None, ge=0, description="return rows with id > after_id"),
+        limit: Optional[int] = Query(default=None, ge=1, le=MAX_PAGE_SIZE, description="page size; all rows when omitted"),
+        fields: Optional[str] = Query(default=None, description="comma separated response fields, e.g. id,x,y"),
+    ):
+        self.after_id = after_id
+        self.limit = limit
+        self.fields = fields
+
+    def apply(self, stmt, id_col):
+        """Restrict a select to this page, ordered by id."""
+        if self.after_id is None and self.limit is None:
+            return stmt
+        if self.after_id is not None:
+            stmt = stmt.where(id_col > self.after_id)
+        stmt = stmt.order_by(id_col)
+        if self.limit is not None:
+            stmt = stmt.limit(self.limit)
+        return stmt
+
+    def wanted(self, model: Type[BaseModel]) -> Optional[Tuple[str, ...]]:
+        """Requested fields of `model` (id first), or None for full rows; 400 on unknown names."""
+        if self.fields is None:
+            return None
+        names = ["id"]
+        for raw in self.fields.split(","):
+            name = raw.strip()
+            if name and name not in names:
+                names.append(name)
+        unknown = [n for n in names if n not in model.model_fields]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown field(s): {', '.join(unknown)}")
+        return tuple(names)
+
+    def mark_next(self, response: Response, ids: Sequence[int]) -> None:
+        """Set X-Next-After-Id when the page is full (there may be more rows)."""
+        if self.limit is not None and len(ids) == self.limit:
+            response.headers[NEXT_HEADER] = str(ids[-1])
+
+
+def columns_for(entity, wanted: Iterable[str], sources: Optional[Dict[str, Sequence[str]]] = None) -> List[Any]:
+    """Mapped columns behind the wanted fields; `sources` maps derived fields to the columns they are built from."""
+    names: List[str] = []
+    for field in wanted:
+        for col in (sources or {}).get(field, (field,)):
+            if col not in names:
+                names.append(col)
+    return [getattr(entity, n) for n in names]
+
+
+@lru_cache(maxsize=256)
+def _projection(model: Type[BaseModel], fields: Tuple[str, ...]) -> Type[BaseModel]:
+    # same field types (and conversions) as the full model, restricted to `fields`
+    return create_model(
+        f"{model.__name__}Fields",
+        **{f: (model.model_fields[f].annotation, model.model_fields[f]) for f in fields},
+    )
+
+
+def projected(model: Type[BaseModel], fields: Tuple[str, ...], rows: Iterable[Dict[str, Any]], response: Response) -> JSONResponse:
+    """JSON list of `rows` reduced to `fields`, validated like `model`; keeps headers already set on `response`."""
+    proj = _projection(model, fields)
+    body = [proj.model_validate({f: row[f] for f in fields}).model_dump(mode="json") for row in rows]
+    headers = {k: v for k, v in response.headers.items() if k.lower() != "content-length"}
+    return JSONResponse(content=body, headers=headers)
@@ -0,0 +1,300 @@
+"""
+Versioned schema migrations.
+
+The database records the last applied migration in `schema_version` (a single
+row). `MIGRATIONS` is the ordered list of steps; each one is idempotent, so a
+database patched by the old startup probing (or half-patched by hand) is simply
+brought forward. Pending steps run in one transaction that first takes the
+write lock on the `schema_version` row, so when several uvicorn workers start
+together only the first one migrates and the rest find the work done.
+
+Worker startup calls `ensure_current`: a single SELECT when the database is up
+to date. Migrations can also be applied out of band before a deploy:
+
+    python -m migrations            # apply pending migrations
+    python -m migrations --status   # print the current and latest version
+
+and DB_MIGRATE_ON_STARTUP=false makes workers refuse to start on an old schema
+instead of migrating it.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import sys
+from typing import Awaitable, Callable, List, Optional, Set, Tuple
+
+from sqlalchemy import inspect, text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from config import settings
+from database import Base, engine
+import models  # noqa: F401  (registers the tables on Base.metadata)
+
+log = logging.getLogger(__name__)
+
+Step = Callable[[AsyncConnection], Awaitable[None]]
+
+
+# --- helpers -----------------------------------------------------------------
+
+def _is_postgres(conn: AsyncConnection) -> bool:
+    return conn.dialect.name == "postgresql"
+
+
+async def _columns(conn: AsyncConnection, table: str) -> Set[str]:
+    return await conn.run_sync(lambda c: {col["name"] for col in inspect(c).get_columns(table)})
+
+
+async def _add_column(conn: AsyncConnection, table: str, column: str, ddl: str, pg_ddl: Optional[str] = None) -> bool:
+    """ALTER TABLE ... ADD COLUMN unless the column exists; `pg_ddl` overrides the type for Postgres."""
+    if column in await _columns(conn, table):
+        return False
+    spec = pg_ddl if pg_ddl is not None and _is_postgres(conn) else ddl
+    await conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {spec}"))
+    return True
+
+
+# --- migrations ----------------------------------------------------------------
+
+async def _create_tables(conn: AsyncConnection) -> None:
+    # tables of models.py that do not exist yet (existing tables are left alone)
+    await conn.run_sync(Base.metadata.create_all)
+
+
+async def _add_late_columns(conn: AsyncConnection) -> None:
+    # columns added to models.py after their tables were first created
+    await _add_column(conn, "items", "z", "REAL", "NUMERIC(10,4)")
+    await _add_column(conn, "items", "heading_deg", "REAL", "NUMERIC(10,4)")
+    if await _add_column(conn, "items", "mart_id", "INTEGER"):
+        # existing items go to the first mart (created when there is none)
+        row = (await conn.execute(text("SELECT MIN(id) FROM marts"))).first()
+        if row is None or row[0] is None:
+            await conn.execute(text("INSERT INTO marts (name) VALUES ('Default Mart')"))
+            row = (await conn.execute(text("SELECT MIN(id) FROM marts"))).first()
+        await conn.execute(text("UPDATE items SET mart_id = :mid WHERE mart_id IS NULL"), {"mid": int(row[0])})
+    await _add_column(conn, "items", "sale_end_at", "TIMESTAMP")
+    await _add_column(conn, "items", "category_id", "INTEGER")
+    await _add_column(conn, "marts", "route_snap_eps", "REAL", "NUMERIC(10,4)")
+    for table in ("segments", "paths"):
+        await _add_column(conn, table, "mart_id", "INTEGER REFERENCES marts(id)",
+                          "INTEGER REFERENCES marts(id) ON DELETE CASCADE ON UPDATE CASCADE")
+    await _add_column(conn, "segments", "z", "REAL", "NUMERIC(10,4)")
+    await _add_column(conn, "segments", "polyline_blob", "BLOB", "BYTEA")
+    # Cloudinary-backed file storage (sql/20251118_add_cloudinary_columns.sql)
+    await _add_column(conn, "stored_files", "url", "TEXT")
+    await _add_column(conn, "stored_files", "cloudinary_public_id", "VARCHAR(255)")
+    if _is_postgres(conn):
+        await conn.execute(text("ALTER TABLE stored_files ALTER COLUMN data DROP NOT NULL"))
+
+
+async def _backfill_segment_marts(conn: AsyncConnection) -> None:
+    # segments/paths.mart_id from the linked item, or the only mart when there is
+    # just one (free-drawn segments in multi-mart setups stay shared)
+    for table in ("segments", "paths"):
+        await conn.execute(text(
+            f"UPDATE {table} SET mart_id = (SELECT items.mart_id FROM items WHERE items.id = {table}.from_item_id) "
+            "WHERE mart_id IS NULL AND from_item_id IS NOT NULL"
+        ))
+        await conn.execute(text(
+            f"UPDATE {table} SET mart_id = (SELECT MIN(id) FROM marts) "
+            "WHERE mart_id IS NULL AND (SELECT COUNT(*) FROM marts) = 1"
+        ))
+
+
+async def _pack_polylines(conn: AsyncConnection) -> None:
+    # polyline_blob for segments saved before the column existed
+    import polyline_codec
+    res = await conn.execute(text("SELECT id, polyline_json FROM segments WHERE polyline_blob IS NULL"))
+    packed = []
+    for sid, raw in res.all():
+        try:
+            pts = [(float(p["x"]), float(p["y"])) for p in json.loads(raw)]
+        except Exception:
+            continue
+        if pts:
+            packed.append({"b": polyline_codec.to_blob(pts), "id": sid})
+    if packed:
+        await conn.execute(text("UPDATE segments SET polyline_blob = :b WHERE id = :id"), packed)
+
+
+async def _move_slam_items(conn: AsyncConnection) -> None:
+    # items.type = 'slam_start' rows predate the slam_start table
+    res = await conn.execute(text("SELECT x, y, z, heading_deg FROM items WHERE type = 'slam_start'"))
+    rows = [
+        {"x": float(x), "y": float(y), "z": float(z) if z is not None else None, "h": float(h) if h is not None else None}
+        for x, y, z, h in res.all()
+    ]
+    if rows:
+        await conn.execute(text("INSERT INTO slam_start (x,y,z,heading_deg) VALUES (:x,:y,:z,:h)"), rows)
+        await conn.execute(text("DELETE FROM items WHERE type = 'slam_start'"))
+
+
+async def _add_indexes(conn: AsyncConnection) -> None:
+    # same names as the index=True columns in models.py, which create_all only
+    # adds to new tables
+    for name, table, column in (
+        ("ix_items_sale_end_at", "items", "sale_end_at"),
+        ("ix_items_mart_id", "items", "mart_id"),
+        ("ix_items_type", "items", "type"),
+        ("ix_categories_mart_id", "categories", "mart_id"),
+    ):
+        await conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({column})"))
+
+
+async def _fill_item_anchors(conn: AsyncConnection) -> None:
+    # snap every item onto the walkable network once; the item and segment write
+    # endpoints keep item_anchors fresh afterwards. Core queries over the columns
+    # that exist at this version only: the ORM models (and the route loaders built
+    # on them) describe the latest schema, which later migrations complete.
+    from routers import route
+    if (await conn.execute(text("SELECT item_id FROM item_anchors LIMIT 1"))).first() is not None:
+        return
+    items = (await conn.execute(text("SELECT id, mart_id, x, y, z FROM items"))).all()
+    if not items:
+        return
+    eps_of = dict((await conn.execute(text("SELECT id, route_snap_eps FROM marts"))).all())
+    segments = []
+    res = await conn.execute(text("SELECT id, mart_id, z, polyline_blob, polyline_json FROM segments"))
+    for sid, mid, z, blob, raw in res.all():
+        try:
+            pts = route._segment_array(blob, raw)
+        except Exception:
+            continue
+        if len(pts) >= 2:
+            segments.append((sid, mid, route._FLOOR0 if z is None else float(z), pts))
+
+    # same scoping as the route loaders: a mart's segments plus shared ones, one
+    # graph per floor when the mart has segments on several floors
+    scopes = {}
+    graphs = {}
+    fresh = []
+    for iid, mid, x, y, z in items:
+        if mid not in scopes:
+            scopes[mid] = [s for s in segments if mid is None or s[1] in (mid, None)]
+        scope = scopes[mid]
+        multi = len({s[2] for s in scope}) > 1
+        floor = (route._FLOOR0 if z is None else float(z)) if multi else None
+        if (mid, floor) not in graphs:
+            on = [s for s in scope if floor is None or s[2] == floor]
+            eps = eps_of.get(mid)
+            eps = float(eps) if eps is not None else float(settings.ROUTE_SNAP_EPS)
+            graphs[(mid, floor)] = route._compile_graph([s[3] for s in on], eps, [s[0] for s in on])
+        found = graphs[(mid, floor)].index.anchor((float(x), float(y)))
+        if found is None or found[0] is None:
+            continue
+        sid, piece, t, a, b, q = found
+        fresh.append({"i": iid, "s": sid, "k": piece, "t": t, "x": q[0], "y": q[1],
+                      "ax": a[0], "ay": a[1], "bx": b[0], "by": b[1]})
+    if fresh:
+        await conn.execute(text(
+            "INSERT INTO item_anchors (item_id, segment_id, seg_index, t, x, y, a_x, a_y, b_x, b_y, updated_at) "
+            "VALUES (:i, :s, :k, :t, :x, :y, :ax, :ay, :bx, :by, CURRENT_TIMESTAMP)"
+        ), fresh)
+
+
+async def _add_content_versions(conn: AsyncConnection) -> None:
+    # marts.content_version and the catalog_clock row (catalog_version.py)
+    await conn.run_sync(Base.metadata.create_all)
+    await _add_column(conn, "marts", "content_version", "INTEGER NOT NULL DEFAULT 0")
+    await conn.execute(text("INSERT INTO catalog_clock (id, version) VALUES (1, 0) ON CONFLICT (id) DO NOTHING"))
+
+
+async def _add_row_versions(conn: AsyncConnection) -> None:
+    # per-row content_version and catalog_tombstones for /api/marts/{id}/changes;
+    # existing rows stay at 0, i.e. part of any full sync
+    await conn.run_sync(Base.metadata.create_all)
+    for table in ("items", "categories", "segments"):
+        await _add_column(conn, table, "content_version", "INTEGER NOT NULL DEFAULT 0")
+        await conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{table}_content_version ON {table} (content_version)"))
+
+
+async def _add_route_versions(conn: AsyncConnection) -> None:
+    # route_version next to content_version: the route caches key on it (graph_cache.py)
+    for table in ("marts", "catalog_clock"):
+        await _add_column(conn, table, "route_version", "INTEGER NOT NULL DEFAULT 0")
+
+
+# (version, name, step) in the order they are applied; append only, never renumber
+MIGRATIONS: List[Tuple[int, str, Step]] = [
+    (1, "create tables", _create_tables),
+    (2, "add late columns", _add_late_columns),
+    (3, "backfill segments/paths mart_id", _backfill_segment_marts),
+    (4, "pack segment polylines", _pack_polylines),
+    (5, "move slam_start items", _move_slam_items),
+    (6, "add catalog indexes", _add_indexes),
+    (7, "fill item anchors", _fill_item_anchors),
+    (8, "add catalog content versions", _add_content_versions),
+    (9, "add row versions and tombstones", _add_row_versions),
+    (10, "add route versions", _add_route_versions),
+]
+
+LATEST = MIGRATIONS[-1][0]
+
+
+# --- runner --------------------------------------------------------------------
+
+async def current_version() -> int:
+    """Applied schema version; 0 for a database that has never been migrated."""
+    try:
+        async with engine.connect() as conn:
+            row = (await conn.execute(text("SELECT version FROM schema_version WHERE id = 1"))).first()
+    except Exception:
+        return 0
+    return int(row[0]) if row is not None else 0
+
+
+async def migrate() -> int:
+    """Apply every pending migration under the schema_version row lock; returns the new version."""
+    async with engine.begin() as conn:
+        await conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_version ("
+            "id INTEGER PRIMARY KEY, version INTEGER NOT NULL, updated_at TIMESTAMP)"
+        ))
+        await conn.execute(text(
+            "INSERT INTO schema_version (id, version, updated_at) VALUES (1, 0, CURRENT_TIMESTAMP) "
+            "ON CONFLICT (id) DO NOTHING"
+        ))
+    async with engine.begin() as conn:
+        # the write takes the lock (row lock on Postgres, database write lock on
+        # SQLite); concurrent callers wait here and then see the new version
+        await conn.execute(text("UPDATE schema_version SET version = version WHERE id = 1"))
+        version = (await conn.execute(text("SELECT version FROM schema_version WHERE id = 1"))).scalar_one()
+        for number, name, step in MIGRATIONS:
+            if number <= version:
+                continue
+            log.info("applying migration %d: %s", number, name)
+            await step(conn)
+            version = number
+        await conn.execute(
+            text("UPDATE schema_version SET version = :v, updated_at = CURRENT_TIMESTAMP WHERE id = 1"),
+            {"v": version},
+        )
+    return version
+
+
+async def ensure_current() -> None:
+    """Startup check: nothing to do when up to date, else migrate (or fail if that is disabled)."""
+    version = await current_version()
+    if version >= LATEST:
+        return
+    if not settings.DB_MIGRATE_ON_STARTUP:
+        raise RuntimeError(
+            f"database schema is at version {version}, expected {LATEST}; run `python -m migrations`"
+        )
+    await migrate()
+
+
+async def _main(argv: List[str]) -> int:
+    if "--status" in argv:
+        print(f"schema version {await current_version()} (latest {LATEST})")
+        return 0
+    print(f"schema version {await migrate()}")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    engine.echo = False
+    sys.exit(asyncio.run(_main(sys.argv[1:])))
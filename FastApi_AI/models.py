@@ -1,5 +1,5 @@
 # models.py
-from sqlalchemy import Column, Integer, String, DECIMAL, Text, ForeignKey, TIMESTAMP, func, LargeBinary
+from sqlalchemy import Column, Integer, String, DECIMAL, Float, Text, ForeignKey, TIMESTAMP, func, LargeBinary
 from sqlalchemy.orm import relationship
 from database import Base
 
@@ -7,16 +7,16 @@ class Item(Base):
     __tablename__ = "items"
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    mart_id = Column(Integer, ForeignKey("marts.id", ondelete="CASCADE", onupdate="CASCADE"), nullable=False)
+    mart_id = Column(Integer, ForeignKey("marts.id", ondelete="CASCADE", onupdate="CASCADE"), nullable=False, index=True)
 
     # үндсэн мэдээлэл
     name = Column(String(100), nullable=False)          # "Coffee Section" эсвэл "Nescafe Gold 200g"
-    type = Column(String(50),  nullable=False)          # "product_zone", "product", "entrance", "checkout"
+    type = Column(String(50),  nullable=False, index=True)  # "product_zone", "product", "entrance", "checkout"
 
     # дэлгүүрийн зураг дээрх байрлал
     x = Column(DECIMAL(10,4), nullable=False)           # pixel X in map coords
     y = Column(DECIMAL(10,4), nullable=False)           # pixel Y in map coords
-    z = Column(DECIMAL(10,4), nullable=True)            # optional floor/height (future use)
+    z = Column(DECIMAL(10,4), nullable=True)            # optional floor (NULL = 0); used by multi-floor routing
 
     image_url = Column(Text, nullable=True)             # thumbnail / shelf photo
     note = Column(Text, nullable=True)                  # дотоод тэмдэглэл (админы хувьд)
@@ -27,10 +27,13 @@ class Item(Base):
     price = Column(DECIMAL(10,2), nullable=True)        # 12900.00 ₩ гэх мэт
     sale_percent = Column(Integer, nullable=True)       # 30 гэж хадгалаад "30%" гэж үзэж болно
     # Sale дуусах хугацаа; хугацаа дууссан бол API талд sale_percent-ийг null болгоно
+    # (DB дээр sale_expiry-ийн background task цэвэрлэнэ)
     from sqlalchemy import TIMESTAMP as _TS
-    sale_end_at = Column(_TS, nullable=True)
+    sale_end_at = Column(_TS, nullable=True, index=True)
     description = Column(Text, nullable=True)           # "Rich aroma instant coffee ..."
     heading_deg = Column(DECIMAL(10,4), nullable=True)  # optional: SLAM start heading in degrees
+    # сүүлд өөрчлөгдсөн catalog хувилбар (marts.content_version); delta sync-д
+    content_version = Column(Integer, nullable=False, default=0, server_default="0", index=True)
 
     created_at = Column(
         TIMESTAMP,
@@ -52,6 +55,8 @@ class Path(Base):
     __tablename__ = "paths"
 
     id = Column(Integer, primary_key=True, autoincrement=True)
+    # owning mart; NULL only for legacy rows that could not be backfilled
+    mart_id = Column(Integer, ForeignKey("marts.id", ondelete="CASCADE", onupdate="CASCADE"), nullable=True)
 
     from_item_id = Column(Integer, ForeignKey("items.id", ondelete="CASCADE", onupdate="CASCADE"), nullable=False)
     to_item_id   = Column(Integer, ForeignKey("items.id", ondelete="CASCADE", onupdate="CASCADE"), nullable=False)
@@ -89,6 +94,14 @@ class Mart(Base):
     # Public URL to map image served from /uploads
     map_image_url = Column(Text, nullable=True)
 
+    # Routing: max gap (map pixels) bridged between drawn segments; NULL = settings default
+    route_snap_eps = Column(DECIMAL(10,4), nullable=True)
+    # Catalog (items/categories/segments/paths) хувилбар: бичих endpoint бүр catalog_clock-оос
+    # шинэ утга авч өсгөнө; ETag болон delta sync үүгээр ажиллана
+    content_version = Column(Integer, nullable=False, default=0, server_default="0")
+    # Замын граф (segments, route_snap_eps) өөрчлөгдсөн catalog_clock-ийн утга; route кэш үүгээр шинэчлэгдэнэ
+    route_version = Column(Integer, nullable=False, default=0, server_default="0")
+
     created_at = Column(
         TIMESTAMP,
         server_default=func.current_timestamp()
@@ -102,12 +115,70 @@ class Segment(Base):
     __tablename__ = "segments"
 
     id = Column(Integer, primary_key=True, autoincrement=True)
+    # owning mart; NULL only for legacy rows that could not be backfilled (shared by all marts)
+    mart_id = Column(Integer, ForeignKey("marts.id", ondelete="CASCADE", onupdate="CASCADE"), nullable=True)
 
     from_item_id = Column(Integer, ForeignKey("items.id", ondelete="SET NULL"), nullable=True)
     to_item_id   = Column(Integer, ForeignKey("items.id", ondelete="SET NULL"), nullable=True)
 
     polyline_json = Column(Text, nullable=False)  # store raw JSON string
+    # same points packed as little-endian float64 x,y pairs (polyline_codec.to_blob); read first when set
+    polyline_blob = Column(LargeBinary, nullable=True)
     walkable = Column(Integer, nullable=False, default=1)
+    # floor (same scale as items.z); NULL = ground floor 0
+    z = Column(DECIMAL(10,4), nullable=True)
+    # catalog version of the last write (delta sync)
+    content_version = Column(Integer, nullable=False, default=0, server_default="0", index=True)
+
+    created_at = Column(
+        TIMESTAMP,
+        server_default=func.current_timestamp()
+    )
+
+
+class ItemAnchor(Base):
+    """Item position snapped onto the walkable network, kept so routing can skip the snap."""
+    __tablename__ = "item_anchors"
+
+    item_id = Column(Integer, ForeignKey("items.id", ondelete="CASCADE", onupdate="CASCADE"), primary_key=True)
+    segment_id = Column(Integer, ForeignKey("segments.id", ondelete="CASCADE", onupdate="CASCADE"), nullable=False)
+    seg_index = Column(Integer, nullable=False)         # piece of the segment polyline (0 = first two points)
+    t = Column(Float, nullable=False)                   # 0..1 along that piece
+    # plain floats (not DECIMAL): the end points must match graph node coordinates exactly
+    x = Column(Float, nullable=False)                   # projected point
+    y = Column(Float, nullable=False)
+    a_x = Column(Float, nullable=False)                 # graph nodes at the ends of the piece
+    a_y = Column(Float, nullable=False)
+    b_x = Column(Float, nullable=False)
+    b_y = Column(Float, nullable=False)
+
+    updated_at = Column(
+        TIMESTAMP,
+        server_default=func.current_timestamp(),
+        onupdate=func.current_timestamp()
+    )
+
+
+class CatalogClock(Base):
+    """Single row (id=1) counting catalog writes across all marts; marts.content_version takes its values."""
+    __tablename__ = "catalog_clock"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    # last version that changed routing in any mart (marts.route_version of mart-less routes)
+    route_version = Column(Integer, nullable=False, default=0, server_default="0")
+
+
+class CatalogTombstone(Base):
+    """A deleted (or moved to another mart) item, category or segment, for /api/marts/{id}/changes."""
+    __tablename__ = "catalog_tombstones"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    # mart the row disappeared from; NULL = shared segment (every mart)
+    mart_id = Column(Integer, ForeignKey("marts.id", ondelete="CASCADE", onupdate="CASCADE"), nullable=True, index=True)
+    kind = Column(String(16), nullable=False)            # "item" | "category" | "segment"
+    object_id = Column(Integer, nullable=False)
+    content_version = Column(Integer, nullable=False, index=True)
 
     created_at = Column(
         TIMESTAMP,
@@ -162,11 +233,13 @@ class Category(Base):
     __tablename__ = "categories"
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    mart_id = Column(Integer, ForeignKey("marts.id", ondelete="CASCADE", onupdate="CASCADE"), nullable=False)
+    mart_id = Column(Integer, ForeignKey("marts.id", ondelete="CASCADE", onupdate="CASCADE"), nullable=False, index=True)
     name = Column(String(120), nullable=False)
     # store polygon as JSON array of points [{x,y},...], closed (first=last)
     polygon_json = Column(Text, nullable=False)
     color = Column(String(24), nullable=True)
+    # catalog version of the last write (delta sync)
+    content_version = Column(Integer, nullable=False, default=0, server_default="0", index=True)
 
     created_at = Column(
         TIMESTAMP,
@@ -0,0 +1,114 @@
+"""
+Compact route polylines.
+
+`simplify` drops near-collinear vertices (Douglas-Peucker) and `encode` /
+`decode` implement the "encoded polyline" format (scaled integer deltas,
+zig-zag signed, written as 5-bit chunks in printable ASCII), applied to map
+x/y instead of lat/lng. `flatten` gives the plain [x0, y0, x1, y1, ...] form.
+`to_blob` / `from_blob` are the packed binary form stored in
+`segments.polyline_blob`.
+"""
+from __future__ import annotations
+
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+Point = Tuple[float, float]
+
+
+def simplify(points: Sequence[Point], tolerance: float) -> List[Point]:
+    """
+    Douglas-Peucker: keep the first and last point and every vertex that lies
+    farther than `tolerance` (map units) from the chord of its span.
+    """
+    n = len(points)
+    if n < 3 or tolerance <= 0:
+        return list(points)
+    keep = [False] * n
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    tol2 = tolerance * tolerance
+    while stack:
+        i, j = stack.pop()
+        ax, ay = points[i]
+        bx, by = points[j]
+        dx, dy = bx - ax, by - ay
+        seg2 = dx * dx + dy * dy
+        best, best_k = -1.0, -1
+        for k in range(i + 1, j):
+            px, py = points[k]
+            if seg2 == 0.0:
+                d2 = (px - ax) ** 2 + (py - ay) ** 2
+            else:
+                # squared distance to the segment (clamped), so spans that turn
+                # back on themselves keep their far end
+                t = max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / seg2))
+                d2 = (px - ax - t * dx) ** 2 + (py - ay - t * dy) ** 2
+            if d2 > best:
+                best, best_k = d2, k
+        if best > tol2:
+            keep[best_k] = True
+            stack.append((i, best_k))
+            stack.append((best_k, j))
+    return [p for p, k in zip(points, keep) if k]
+
+
+def flatten(points: Sequence[Point]) -> List[float]:
+    return [c for p in points for c in p]
+
+
+def _encode_value(v: int, out: List[str]) -> None:
+    v = ~(v << 1) if v < 0 else v << 1
+    while v >= 0x20:
+        out.append(chr((0x20 | (v & 0x1F)) + 63))
+        v >>= 5
+    out.append(chr(v + 63))
+
+
+def encode(points: Sequence[Point], precision: int = 2) -> str:
+    """Encoded polyline of (x, y) points rounded to `precision` decimals."""
+    scale = 10 ** precision
+    out: List[str] = []
+    px = py = 0
+    for x, y in points:
+        ix, iy = int(round(x * scale)), int(round(y * scale))
+        _encode_value(ix - px, out)
+        _encode_value(iy - py, out)
+        px, py = ix, iy
+    return "".join(out)
+
+
+def decode(data: str, precision: int = 2) -> List[Point]:
+    scale = 10 ** precision
+    values: List[int] = []
+    shift = acc = 0
+    for ch in data:
+        b = ord(ch) - 63
+        acc |= (b & 0x1F) << shift
+        shift += 5
+        if b < 0x20:
+            values.append(~(acc >> 1) if acc & 1 else acc >> 1)
+            shift = acc = 0
+    points: List[Point] = []
+    x = y = 0
+    for i in range(0, len(values) - 1, 2):
+        x += values[i]
+        y += values[i + 1]
+        points.append((x / scale, y / scale))
+    return points
+
+
+# little-endian float64 x, y pairs: exact for any coordinate JSON can carry
+BLOB_DTYPE = np.dtype("<f8")
+
+
+def to_blob(points: Sequence[Point]) -> bytes:
+    return np.asarray(points, dtype=BLOB_DTYPE).reshape(-1, 2).tobytes()
+
+
+def from_blob(data: Optional[bytes]) -> Optional[np.ndarray]:
+    """(N, 2) read-only view over a blob without copying it; None if it is missing or malformed."""
+    if not data or len(data) % (2 * BLOB_DTYPE.itemsize):
+        return None
+    return np.frombuffer(data, dtype=BLOB_DTYPE).reshape(-1, 2)
@@ -0,0 +1,116 @@
+"""
+Executor for CPU-bound routing work.
+
+Graph builds and searches are plain Python; run directly inside an `async def`
+handler they block the event loop, so one heavy route stalls every other
+request on that uvicorn worker. `run` and `run_on_graph` hand the work to the
+pool selected by ROUTE_POOL and await the result:
+
+- "thread" (default): a thread pool; compiled graphs are shared by reference.
+- "process": a process pool, for routing that really runs in parallel. A
+  compiled graph is pickled to a pool process only the first time that process
+  is asked to work on it; after that only the query arguments travel.
+- "none": run inline on the event loop (debugging, tests).
+
+The pool is created on first use, i.e. after uvicorn has started (and forked)
+its workers, so every worker owns its own pool.
+"""
+from __future__ import annotations
+
+import asyncio
+import itertools
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional, Tuple
+
+from config import settings
+
+POOL_MODES = ("thread", "process", "none")
+
+# graphs remembered for shipping (here) and kept by each pool process (there)
+_MAX_GRAPHS = 32
+
+_executor: Optional[Executor] = None
+_mode: Optional[str] = None
+_tokens = itertools.count(1)
+# id(graph) -> (token, graph); holding the graph keeps its id from being reused
+_shipped: "OrderedDict[int, Tuple[int, Any]]" = OrderedDict()
+
+
+def _pool() -> Optional[Executor]:
+    global _executor, _mode
+    if _mode is None:
+        mode = (settings.ROUTE_POOL or "thread").strip().lower()
+        if mode not in POOL_MODES:
+            raise ValueError(f"ROUTE_POOL must be one of {', '.join(POOL_MODES)}")
+        workers = settings.ROUTE_POOL_WORKERS if settings.ROUTE_POOL_WORKERS > 0 else None
+        if mode == "process":
+            _executor = ProcessPoolExecutor(max_workers=workers)
+        elif mode == "thread":
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="route")
+        _mode = mode
+    return _executor
+
+
+async def run(fn: Callable, *args) -> Any:
+    """fn(*args) in the pool. Arguments and result must pickle in process mode."""
+    pool = _pool()
+    if pool is None:
+        return fn(*args)
+    return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+
+
+async def run_on_graph(graph: Any, fn: Callable, *args, pack: Optional[Callable[[Any], Any]] = None) -> Any:
+    """
+    fn(graph, *args) in the pool. In process mode `graph` is sent to a pool
+    process only when that process does not hold it yet; `pack(graph)` may
+    return a lighter copy to send (e.g. without per-process caches).
+    """
+    pool = _pool()
+    if _mode != "process":
+        return await run(fn, graph, *args)
+    token = _token(graph)
+    loop = asyncio.get_running_loop()
+    found, result = await loop.run_in_executor(pool, _call, token, None, fn, args)
+    if not found:
+        payload = pack(graph) if pack is not None else graph
+        found, result = await loop.run_in_executor(pool, _call, token, payload, fn, args)
+    return result
+
+
+def _token(graph: Any) -> int:
+    entry = _shipped.get(id(graph))
+    if entry is None or entry[1] is not graph:
+        entry = _shipped[id(graph)] = (next(_tokens), graph)
+        while len(_shipped) > _MAX_GRAPHS:
+            _shipped.popitem(last=False)
+    else:
+        _shipped.move_to_end(id(graph))
+    return entry[0]
+
+
+def shutdown() -> None:
+    global _executor, _mode
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+    _executor = None
+    _mode = None
+    _shipped.clear()
+
+
+# --- pool process side -------------------------------------------------------
+
+_graphs: "OrderedDict[int, Any]" = OrderedDict()
+
+
+def _call(token: int, graph: Any, fn: Callable, args: tuple) -> Tuple[bool, Any]:
+    """(False, None) when this process does not hold the graph yet, else (True, fn(graph, *args))."""
+    if graph is not None:
+        _graphs[token] = graph
+        while len(_graphs) > _MAX_GRAPHS:
+            _graphs.popitem(last=False)
+    held = _graphs.get(token)
+    if held is None:
+        return False, None
+    _graphs.move_to_end(token)
+    return True, fn(held, *args)
@@ -1,12 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, update
 import json
 
 from database import get_db
-from models import Category
+from models import Category, Item
 from schemas import CategoryCreate, CategoryRead
 from typing import List
+from listing import Page, columns_for, projected
+import catalog_version
 
 router = APIRouter(prefix="/api/categories", tags=["categories"])
 
@@ -21,22 +23,43 @@ def ensure_closed_polygon(points: list[dict]) -> list[dict]:
     return points
 
 
-@router.get("", response_model=List[CategoryRead])
-async def list_categories(mart_id: int | None = Query(default=None), db: AsyncSession = Depends(get_db)):
-    stmt = select(Category)
+def _polygon(raw) -> list:
+    try:
+        return json.loads(raw)
+    except Exception:
+        return []
+
+
+def category_read(c: Category) -> CategoryRead:
+    return CategoryRead(id=c.id, mart_id=c.mart_id, name=c.name, polygon=_polygon(c.polygon_json), color=c.color)
+
+
+@router.get("", response_model=List[CategoryRead], dependencies=[Depends(catalog_version.conditional("categories"))])
+async def list_categories(
+    response: Response,
+    mart_id: int | None = Query(default=None),
+    page: Page = Depends(),
+    db: AsyncSession = Depends(get_db),
+):
+    wanted = page.wanted(CategoryRead)
+    if wanted is None:
+        stmt = select(Category)
+    else:
+        stmt = select(*columns_for(Category, wanted, {"polygon": ("polygon_json",)}))
     if mart_id is not None:
         stmt = stmt.where(Category.mart_id == mart_id)
-    res = await db.execute(stmt)
-    rows = res.scalars().all()
-    # decode polygon JSON
-    out = []
-    for c in rows:
-        try:
-            poly = json.loads(c.polygon_json)
-        except Exception:
-            poly = []
-        out.append(CategoryRead(id=c.id, mart_id=c.mart_id, name=c.name, polygon=poly, color=c.color))
-    return out
+    res = await db.execute(page.apply(stmt, Category.id))
+    rows = res.scalars().all() if wanted is None else res.all()
+    page.mark_next(response, [c.id for c in rows])
+    if wanted is not None:
+        out_rows = []
+        for row in rows:
+            data = dict(row._mapping)
+            if "polygon" in wanted:
+                data["polygon"] = _polygon(row.polygon_json)
+            out_rows.append(data)
+        return projected(CategoryRead, wanted, out_rows, response)
+    return [category_read(c) for c in rows]
 
 
 @router.post("", response_model=CategoryRead)
@@ -44,6 +67,7 @@ async def create_category(cat: CategoryCreate, db: AsyncSession = Depends(get_db
     points = [ {"x": float(p.x), "y": float(p.y)} for p in cat.polygon ]
     points = ensure_closed_polygon(points)
     c = Category(mart_id=cat.mart_id, name=cat.name, polygon_json=json.dumps(points), color=cat.color)
+    c.content_version = await catalog_version.bump(db, cat.mart_id)
     db.add(c)
     await db.commit()
     await db.refresh(c)
@@ -57,6 +81,10 @@ async def update_category(cat_id: int, cat: CategoryCreate, db: AsyncSession = D
         raise HTTPException(status_code=404, detail="Category not found")
     points = [ {"x": float(p.x), "y": float(p.y)} for p in cat.polygon ]
     points = ensure_closed_polygon(points)
+    version = await catalog_version.bump(db, {obj.mart_id, cat.mart_id})
+    if obj.mart_id != cat.mart_id:
+        catalog_version.bury(db, "category", obj.id, obj.mart_id, version)
+    obj.content_version = version
     obj.mart_id = cat.mart_id
     obj.name = cat.name
     obj.polygon_json = json.dumps(points)
@@ -71,6 +99,10 @@ async def delete_category(cat_id: int, db: AsyncSession = Depends(get_db)):
     obj = await db.get(Category, cat_id)
     if not obj:
         raise HTTPException(status_code=404, detail="Category not found")
+    version = await catalog_version.bump(db, obj.mart_id)
+    catalog_version.bury(db, "category", cat_id, obj.mart_id, version)
+    # items lose the category (ON DELETE SET NULL, done here so they are stamped too)
+    await db.execute(update(Item).where(Item.category_id == cat_id).values(category_id=None, content_version=version))
     await db.delete(obj)
     await db.commit()
     return None
@@ -10,6 +10,7 @@ from database import get_db
 from models import Item
 from schemas import ChatbotRequest, ChatbotResponse
 from config import settings
+import sale_expiry
 
 
 router = APIRouter(prefix="/api/chatbot", tags=["chatbot"])
@@ -161,7 +162,7 @@ def _items_to_minimal_dict(items: List[Item]) -> List[Dict[str, Any]]:
             "y": float(it.y),
             "z": float(it.z) if getattr(it, 'z', None) is not None else None,
             "price": float(it.price) if it.price is not None else None,
-            "sale_percent": int(it.sale_percent) if it.sale_percent is not None else None,
+            "sale_percent": sale_expiry.effective_sale_percent(it),
             "description": it.description or None,
         })
     return out
@@ -281,7 +282,8 @@ async def chatbot(req: ChatbotRequest, db: AsyncSession = Depends(get_db)):
             parts = []
             for it in found:
                 price_txt = (str(it.price) if it.price is not None else '정보 없음')
-                sale_txt = (f"할인 {it.sale_percent}%" if it.sale_percent is not None else '할인 정보 없음')
+                sale = sale_expiry.effective_sale_percent(it)
+                sale_txt = (f"할인 {sale}%" if sale is not None else '할인 정보 없음')
                 parts.append(f"{it.name}: 가격 {price_txt}, {sale_txt}")
             reply = "; ".join(parts) if parts else "관련 정보를 찾을 수 없습니다."
         else:
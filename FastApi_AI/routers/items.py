@@ -1,18 +1,21 @@
 # routers/items.py
 from fastapi import APIRouter, Depends, HTTPException, Response, Query, UploadFile, File
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, delete
 from typing import List
-from datetime import datetime, timezone
 import os
 import uuid
 import json
 
 from database import get_db
-from models import Item, Segment, Path, Category
+from models import Item, Segment, Path, Category, ItemAnchor
 from sqlalchemy import update
 from schemas import ItemCreate, ItemRead
 from file_storage import save_file, delete_file_by_slug
+import catalog_version
+import sale_expiry
+from listing import Page, columns_for, projected
+import anchor_refresh
 
 router = APIRouter(prefix="/api/items", tags=["items"])
 
@@ -43,6 +46,11 @@ def _point_in_polygon(x: float, y: float, points: list[dict]) -> bool:
     return inside
 
 
+def _position(x, y, z):
+    """(x, y, z) as floats (z may be None), so DB and request values compare equal."""
+    return float(x), float(y), None if z is None else float(z)
+
+
 async def _auto_category_id(db: AsyncSession, mart_id: int | None, x: float, y: float) -> int | None:
     if mart_id is None:
         return None
@@ -56,40 +64,46 @@ async def _auto_category_id(db: AsyncSession, mart_id: int | None, x: float, y:
             return cat.id
     return None
 
-@router.get("", response_model=List[ItemRead])
-async def list_items(mart_id: int | None = Query(default=None), db: AsyncSession = Depends(get_db)):
-    stmt = select(Item)
+def item_read(row: Item, now) -> ItemRead:
+    """ItemRead with the sale hidden once it ended (the DB is cleared later by sale_expiry)."""
+    item = ItemRead.model_validate(row)
+    item.sale_percent = sale_expiry.effective_sale_percent(row, now)
+    return item
+
+
+@router.get("", response_model=List[ItemRead], dependencies=[Depends(catalog_version.conditional("items", extra=sale_expiry.lapsed_sales))])
+async def list_items(
+    response: Response,
+    mart_id: int | None = Query(default=None),
+    page: Page = Depends(),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Item жагсаалт. after_id/limit-ээр id дарааллаар хуудаслана, fields=id,x,y
+    өгвөл зөвхөн тэр баганыг SQL-ээс уншина (газрын зургийн pin-д хангалттай).
+    """
+    wanted = page.wanted(ItemRead)
+    if wanted is None:
+        stmt = select(Item)
+    else:
+        # the effective sale_percent also needs sale_end_at
+        stmt = select(*columns_for(Item, wanted, {"sale_percent": ("sale_percent", "sale_end_at")}))
     if mart_id is not None:
         stmt = stmt.where(Item.mart_id == mart_id)
-    result = await db.execute(stmt)
-    rows = result.scalars().all()
-    # expire sales that have passed
-    changed = False
-    now = datetime.now(timezone.utc)
-    for row in rows:
-        try:
-            if row.sale_end_at is not None:
-                # SQLite stores naive timestamps; handle both
-                end = row.sale_end_at
-                if isinstance(end, str):
-                    try:
-                        end = datetime.fromisoformat(end)
-                    except Exception:
-                        end = None
-                if end is not None and (end.tzinfo is None or end.tzinfo.utcoffset(end) is None):
-                    # make naive times UTC for comparison
-                    end = end.replace(tzinfo=timezone.utc)
-                if end is not None and now > end and row.sale_percent is not None:
-                    row.sale_percent = None
-                    changed = True
-        except Exception:
-            pass
-    if changed:
-        try:
-            await db.commit()
-        except Exception:
-            pass
-    return rows
+    result = await db.execute(page.apply(stmt, Item.id))
+    rows = result.scalars().all() if wanted is None else result.all()
+    page.mark_next(response, [r.id for r in rows])
+    # sales that ended are hidden here and cleared in the DB by the sale_expiry task
+    now = sale_expiry.utcnow()
+    if wanted is not None:
+        out_rows = []
+        for row in rows:
+            data = dict(row._mapping)
+            if "sale_percent" in data:
+                data["sale_percent"] = sale_expiry.effective_sale_percent(row, now)
+            out_rows.append(data)
+        return projected(ItemRead, wanted, out_rows, response)
+    return [item_read(row, now) for row in rows]
 
 @router.post("", response_model=ItemRead)
 async def create_item(item: ItemCreate, db: AsyncSession = Depends(get_db)):
@@ -123,9 +137,11 @@ async def create_item(item: ItemCreate, db: AsyncSession = Depends(get_db)):
         description=item.description,
         heading_deg=item.heading_deg
     )
+    new_item.content_version = await catalog_version.bump(db, item.mart_id)
     db.add(new_item)
     await db.commit()
     await db.refresh(new_item)
+    anchor_refresh.schedule(item_ids=[new_item.id])
     return new_item
 
 @router.put("/{item_id}", response_model=ItemRead)
@@ -142,6 +158,15 @@ async def update_item(item_id: int, item: ItemCreate, db: AsyncSession = Depends
         raise HTTPException(status_code=400, detail="price is required (non-null)")
     if item.image_url is None or (isinstance(item.image_url, str) and item.image_url.strip() == ""):
         raise HTTPException(status_code=400, detail="image_url is required (upload image or provide path)")
+    # a new position, floor or mart needs a new anchor; the old one would pull routes to the old spot
+    moved = (obj.mart_id, *_position(obj.x, obj.y, obj.z)) != (item.mart_id, *_position(item.x, item.y, item.z))
+    if moved:
+        await db.execute(delete(ItemAnchor).where(ItemAnchor.item_id == obj.id))
+    # the item may move to another mart: both catalogs change
+    version = await catalog_version.bump(db, {obj.mart_id, item.mart_id})
+    if obj.mart_id != item.mart_id:
+        catalog_version.bury(db, "item", obj.id, obj.mart_id, version)
+    obj.content_version = version
     obj.mart_id = item.mart_id
     obj.name = item.name
     obj.type = item.type
@@ -163,6 +188,8 @@ async def update_item(item_id: int, item: ItemCreate, db: AsyncSession = Depends
     obj.heading_deg = item.heading_deg
     await db.commit()
     await db.refresh(obj)
+    if moved:
+        anchor_refresh.schedule(item_ids=[obj.id])
     return obj
 
 
@@ -209,6 +236,7 @@ async def set_item_image(item_id: int, file: UploadFile = File(...), db: AsyncSe
     )
     await delete_file_by_slug(db, _slug_from_url(obj.image_url))
     obj.image_url = saved.url
+    obj.content_version = await catalog_version.bump(db, obj.mart_id)
     await db.commit()
     await db.refresh(obj)
     return obj
@@ -219,11 +247,14 @@ async def delete_item(item_id: int, db: AsyncSession = Depends(get_db)):
     if not obj:
         raise HTTPException(status_code=404, detail="Item not found")
     await delete_file_by_slug(db, _slug_from_url(obj.image_url))
+    version = await catalog_version.bump(db, obj.mart_id)
+    catalog_version.bury(db, "item", item_id, obj.mart_id, version)
     # Clean references in segments and paths (defensive, in case FK doesn't SET NULL)
-    await db.execute(update(Segment).where(Segment.from_item_id == item_id).values(from_item_id=None))
-    await db.execute(update(Segment).where(Segment.to_item_id == item_id).values(to_item_id=None))
+    await db.execute(update(Segment).where(Segment.from_item_id == item_id).values(from_item_id=None, content_version=version))
+    await db.execute(update(Segment).where(Segment.to_item_id == item_id).values(to_item_id=None, content_version=version))
     await db.execute(update(Path).where(Path.from_item_id == item_id).values(from_item_id=None))
     await db.execute(update(Path).where(Path.to_item_id == item_id).values(to_item_id=None))
+    await db.execute(delete(ItemAnchor).where(ItemAnchor.item_id == item_id))
     await db.delete(obj)
     await db.commit()
     return Response(status_code=204)
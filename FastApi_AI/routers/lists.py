@@ -7,25 +7,44 @@ import json
 from database import get_db
 from models import ItemList
 from schemas import ItemListCreate, ItemListRead
+from listing import Page, columns_for, projected
 
 router = APIRouter(prefix="/api/lists", tags=["lists"])
 
 
-def _to_read(row: ItemList) -> ItemListRead:
+def _item_ids(raw) -> list[int]:
     try:
-        item_ids = json.loads(row.item_ids_json or "[]")
+        item_ids = json.loads(raw or "[]")
         if not isinstance(item_ids, list):
             item_ids = []
         item_ids = [int(x) for x in item_ids]
     except Exception:
         item_ids = []
-    return ItemListRead(id=row.id, name=row.name, item_ids=item_ids)
+    return item_ids
+
+
+def _to_read(row: ItemList) -> ItemListRead:
+    return ItemListRead(id=row.id, name=row.name, item_ids=_item_ids(row.item_ids_json))
 
 
 @router.get("", response_model=List[ItemListRead])
-async def list_lists(db: AsyncSession = Depends(get_db)):
-    res = await db.execute(select(ItemList))
-    rows = res.scalars().all()
+async def list_lists(response: Response, page: Page = Depends(), db: AsyncSession = Depends(get_db)):
+    wanted = page.wanted(ItemListRead)
+    if wanted is None:
+        stmt = select(ItemList)
+    else:
+        stmt = select(*columns_for(ItemList, wanted, {"item_ids": ("item_ids_json",)}))
+    res = await db.execute(page.apply(stmt, ItemList.id))
+    rows = res.scalars().all() if wanted is None else res.all()
+    page.mark_next(response, [r.id for r in rows])
+    if wanted is not None:
+        out_rows = []
+        for row in rows:
+            data = dict(row._mapping)
+            if "item_ids" in wanted:
+                data["item_ids"] = _item_ids(row.item_ids_json)
+            out_rows.append(data)
+        return projected(ItemListRead, wanted, out_rows, response)
     return [_to_read(r) for r in rows]
 
 
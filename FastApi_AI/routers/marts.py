@@ -1,14 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Response
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Response, Query
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, or_
 from typing import List
 import os
 import uuid
 
 from database import get_db
-from models import Mart
-from schemas import MartCreate, MartRead
+from models import Mart, Item, Category, Segment, CatalogTombstone
+from schemas import MartCreate, MartRead, MartChanges, CatalogDeleted
 from file_storage import save_file, delete_file_by_slug
+import catalog_version
+import sale_expiry
+from routers.items import item_read
+from routers.categories import category_read
+from routers.segments import segment_read
 
 router = APIRouter(prefix="/api/marts", tags=["marts"])
 
@@ -20,13 +25,13 @@ def _slug_from_url(url: str | None) -> str | None:
     return clean.rsplit("/", 1)[-1] if clean else None
 
 
-@router.get("", response_model=List[MartRead])
+@router.get("", response_model=List[MartRead], dependencies=[Depends(catalog_version.conditional("marts"))])
 async def list_marts(db: AsyncSession = Depends(get_db)):
     result = await db.execute(select(Mart))
     rows = result.scalars().all()
     return rows
 
-@router.get("/{mart_id}", response_model=MartRead)
+@router.get("/{mart_id}", response_model=MartRead, dependencies=[Depends(catalog_version.conditional("mart"))])
 async def get_mart(mart_id: int, db: AsyncSession = Depends(get_db)):
     obj = await db.get(Mart, mart_id)
     if not obj:
@@ -34,6 +39,62 @@ async def get_mart(mart_id: int, db: AsyncSession = Depends(get_db)):
     return obj
 
 
+@router.get("/{mart_id}/changes", response_model=MartChanges, dependencies=[Depends(catalog_version.conditional("changes", extra=sale_expiry.lapsed_sales))])
+async def mart_changes(mart_id: int, since: int = Query(default=0, ge=0), db: AsyncSession = Depends(get_db)):
+    """
+    since хувилбараас хойш нэмэгдсэн/өөрчлөгдсөн item, category, segment болон
+    устгагдсан (өөр mart руу шилжсэн) id-ууд. Дараагийн удаа хариуны version-ийг
+    since болгож явуулна. since=0 эсвэл mart-ын хувилбараас их бол full=true
+    бөгөөд бүх catalog-ийг буцаана.
+    """
+    # read before the rows: a racing write shows up again next time, never gets lost
+    version = await catalog_version.current(db, mart_id)
+    if version is None:
+        raise HTTPException(status_code=404, detail="Mart not found")
+    full = since == 0 or since > version
+
+    item_stmt = select(Item).where(Item.mart_id == mart_id)
+    cat_stmt = select(Category).where(Category.mart_id == mart_id)
+    # segments without a mart are shared by every mart
+    seg_stmt = select(Segment).where(or_(Segment.mart_id == mart_id, Segment.mart_id.is_(None)))
+    if not full:
+        item_stmt = item_stmt.where(Item.content_version > since)
+        cat_stmt = cat_stmt.where(Category.content_version > since)
+        seg_stmt = seg_stmt.where(Segment.content_version > since)
+    items = (await db.execute(item_stmt.order_by(Item.id))).scalars().all()
+    cats = (await db.execute(cat_stmt.order_by(Category.id))).scalars().all()
+    segs = (await db.execute(seg_stmt.order_by(Segment.id))).scalars().all()
+
+    deleted = CatalogDeleted()
+    if not full:
+        res = await db.execute(
+            select(CatalogTombstone.kind, CatalogTombstone.object_id)
+            .where(
+                or_(CatalogTombstone.mart_id == mart_id, CatalogTombstone.mart_id.is_(None)),
+                CatalogTombstone.content_version > since,
+            )
+            .order_by(CatalogTombstone.object_id)
+        )
+        # an id that is back (moved in again) is a change, not a deletion
+        alive = {"item": {r.id for r in items}, "category": {c.id for c in cats}, "segment": {s.id for s in segs}}
+        gone = {"item": deleted.items, "category": deleted.categories, "segment": deleted.segments}
+        for kind, object_id in res.all():
+            if kind in gone and object_id not in alive[kind] and object_id not in gone[kind]:
+                gone[kind].append(object_id)
+
+    now = sale_expiry.utcnow()
+    return MartChanges(
+        mart_id=mart_id,
+        since=since,
+        version=version,
+        full=full,
+        items=[item_read(r, now) for r in items],
+        categories=[category_read(c) for c in cats],
+        segments=[segment_read(s) for s in segs],
+        deleted=deleted,
+    )
+
+
 @router.post("", response_model=MartRead)
 async def create_mart(data: MartCreate, db: AsyncSession = Depends(get_db)):
     obj = Mart(
@@ -43,8 +104,11 @@ async def create_mart(data: MartCreate, db: AsyncSession = Depends(get_db)):
         map_width_px=data.map_width_px,
         map_height_px=data.map_height_px,
         map_image_url=data.map_image_url,
+        route_snap_eps=data.route_snap_eps,
     )
     db.add(obj)
+    await db.flush()  # obj.id
+    await catalog_version.bump(db, obj.id, routing=True)
     await db.commit()
     await db.refresh(obj)
     return obj
@@ -61,6 +125,11 @@ async def update_mart(mart_id: int, data: MartCreate, db: AsyncSession = Depends
     obj.map_width_px = data.map_width_px
     obj.map_height_px = data.map_height_px
     obj.map_image_url = data.map_image_url
+    # only when sent: the AdminDashboard's mart form does not know the field
+    snap_eps_sent = "route_snap_eps" in data.model_fields_set
+    if snap_eps_sent:
+        obj.route_snap_eps = data.route_snap_eps
+    await catalog_version.bump(db, mart_id, routing=snap_eps_sent)
     await db.commit()
     await db.refresh(obj)
     return obj
@@ -135,6 +204,7 @@ async def upload_mart_map_image(mart_id: int, file: UploadFile = File(...), db:
     if img_w and img_h:
         obj.map_width_px = int(img_w)
         obj.map_height_px = int(img_h)
+    await catalog_version.bump(db, mart_id)
     await db.commit()
     await db.refresh(obj)
     return obj
@@ -146,6 +216,8 @@ async def delete_mart(mart_id: int, db: AsyncSession = Depends(get_db)):
     if not obj:
         raise HTTPException(status_code=404, detail="Mart not found")
     await delete_file_by_slug(db, _slug_from_url(obj.map_image_url))
+    # advances the clock, so mart-less (all marts) reads change too
+    await catalog_version.bump(db, mart_id, routing=True)
     await db.delete(obj)
     await db.commit()
     return Response(status_code=204)
@@ -1,29 +1,49 @@
 # routers/paths.py
-from fastapi import APIRouter, Depends, HTTPException, Response
+from fastapi import APIRouter, Depends, HTTPException, Response, Query
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, or_
 from typing import List
 
 from database import get_db
-from models import Path
+from models import Path, Item
 from schemas import PathCreate, PathRead
+from listing import Page, columns_for, projected
+import catalog_version
 
 router = APIRouter(prefix="/api/paths", tags=["paths"])
 
-@router.get("", response_model=List[PathRead])
-async def list_paths(db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(Path))
-    rows = result.scalars().all()
+@router.get("", response_model=List[PathRead], dependencies=[Depends(catalog_version.conditional("paths"))])
+async def list_paths(
+    response: Response,
+    mart_id: int | None = Query(default=None),
+    page: Page = Depends(),
+    db: AsyncSession = Depends(get_db),
+):
+    wanted = page.wanted(PathRead)
+    stmt = select(Path) if wanted is None else select(*columns_for(Path, wanted))
+    if mart_id is not None:
+        stmt = stmt.where(or_(Path.mart_id == mart_id, Path.mart_id.is_(None)))
+    result = await db.execute(page.apply(stmt, Path.id))
+    rows = result.scalars().all() if wanted is None else result.all()
+    page.mark_next(response, [r.id for r in rows])
+    if wanted is not None:
+        return projected(PathRead, wanted, [r._mapping for r in rows], response)
     return rows
 
 @router.post("", response_model=PathRead)
 async def create_path(path: PathCreate, db: AsyncSession = Depends(get_db)):
+    mart_id = path.mart_id
+    if mart_id is None:
+        from_item = await db.get(Item, path.from_item_id)
+        mart_id = from_item.mart_id if from_item else None
     new_path = Path(
+        mart_id=mart_id,
         from_item_id=path.from_item_id,
         to_item_id=path.to_item_id,
         distance=path.distance
     )
     db.add(new_path)
+    await catalog_version.bump(db, mart_id)
     await db.commit()
     await db.refresh(new_path)
     return new_path
@@ -34,6 +54,7 @@ async def delete_path(path_id: int, db: AsyncSession = Depends(get_db)):
     obj = await db.get(Path, path_id)
     if not obj:
         raise HTTPException(status_code=404, detail="Path not found")
+    await catalog_version.bump(db, obj.mart_id)
     await db.delete(obj)
     await db.commit()
     return Response(status_code=204)
@@ -1,12 +1,21 @@
 # routers/route.py
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from typing import List, Dict, Tuple, Optional
-import heapq, math, json
-
+from sqlalchemy import select, or_, delete, case
+from typing import List, Dict, Tuple, Optional, NamedTuple, Sequence
+import heapq, math, json, threading
+from array import array
+from collections import OrderedDict
+import numpy as np
+
+from config import settings
 from database import get_db
-from models import Item, Segment
+from models import Item, Segment, Mart, Path, ItemAnchor
+import catalog_version
+import graph_cache
+import route_pool
+import polyline_codec
+from tour_optimizer import solve_path
 from schemas import (
     RouteRequest,
     RouteResponse,
@@ -17,6 +26,11 @@ from schemas import (
     RoutePlanResponse,
     RouteListRequest,
     RouteListResponse,
+    RouteBatchRequest,
+    RouteBatchRoute,
+    RouteBatchResponse,
+    RouteFloorPart,
+    RouteFloorPoint,
 )
 
 router = APIRouter(prefix="/api/route", tags=["route"])
@@ -33,21 +47,26 @@ async def get_route(req: RouteRequest, db: AsyncSession = Depends(get_db)):
 
     if not from_item or not to_item:
         raise HTTPException(status_code=404, detail="Item not found")
+    _check_output_opts(req)
+
+    # Item graph from the paths table (+ linked segment geometry); fall back to the
+    # walkable segment network when the items are not connected by paths
+    mart_id = req.mart_id if req.mart_id is not None else from_item.mart_id
+    pg = await _get_path_graph(db, mart_id)
+    found = await route_pool.run_on_graph(pg, _PathGraph.route, from_item.id, to_item.id)
+    parts = None
+    if found is not None:
+        nodes, pts = found
+    else:
+        plan = await _get_floor_plan(db, mart_id)
+        a, b = from_item.id, to_item.id
+        pos = {a: (float(from_item.x), float(from_item.y)), b: (float(to_item.x), float(to_item.y))}
+        floor_of = {a: plan.floor_of(from_item.z), b: plan.floor_of(to_item.z)}
+        legs = await _floor_legs(db, mart_id, plan, pos, floor_of, [(a, b)])
+        _, pts, parts = legs[(a, b)]
+        nodes = [req.from_item_id, req.to_item_id]
 
-    # NOTE:
-    # Одоо бол mock polyline. Дараа нь paths граф-аас shortest path гаргана.
-    mid_x = (float(from_item.x) + float(to_item.x)) / 2.0
-    mid_y = (float(from_item.y) + float(to_item.y)) / 2.0
-
-    polyline = [
-        RoutePoint(x=float(from_item.x), y=float(from_item.y)),
-        RoutePoint(x=mid_x,             y=mid_y),
-        RoutePoint(x=float(to_item.x),  y=float(to_item.y)),
-    ]
-
-    nodes = [req.from_item_id, req.to_item_id]
-
-    return RouteResponse(polyline=polyline, nodes=nodes)
+    return RouteResponse(nodes=nodes, floors=_floor_parts(parts, req), **_polyline_fields(pts, req))
 
 
 def _qkey(x: float, y: float, prec: int = 4) -> str:
@@ -71,26 +90,124 @@ def _project_point_to_segment(p: Tuple[float, float], a: Tuple[float, float], b:
     qy = ay + t_clamped * aby
     return (qx, qy), t_clamped
 
-def _seg_intersection(p: Tuple[float,float], p2: Tuple[float,float], q: Tuple[float,float], q2: Tuple[float,float]) -> Optional[Tuple[Tuple[float,float], float, float]]:
+# NumPy-batched geometry kernels. They do the same float operations in the same
+# order as the scalar formulas, so every element is bitwise equal to the scalar result.
+
+def _project_point_to_segments(p: Tuple[float, float], segs: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """`_project_point_to_segment` of p onto every (ax, ay, bx, by) row: (qx, qy, t) arrays."""
+    ax, ay, bx, by = segs.T
+    abx = bx - ax; aby = by - ay
+    ab2 = abx*abx + aby*aby
+    zero = ab2 == 0
+    t = ((p[0] - ax)*abx + (p[1] - ay)*aby) / np.where(zero, 1.0, ab2)
+    np.maximum(t, 0.0, out=t); np.minimum(t, 1.0, out=t)
+    # degenerate rows project onto a with t = 0
+    t[zero] = 0.0
+    return ax + t*abx, ay + t*aby, t
+
+
+def _seg_intersections(p: np.ndarray, p2: np.ndarray, q: np.ndarray, q2: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Intersection of segments p-p2 and q-q2 over rows of (K, 2) arrays (a single
+    (2,) point broadcasts, e.g. one segment against many): (hit mask, t, u), with
+    t = (q-p)×s / r×s and u = (q-p)×r / r×s bitwise equal to the scalar formula
+    and only meaningful where the mask is set. Near-parallel pairs (|r×s| < EPS)
+    never hit; t and u may overshoot [0, 1] by EPS.
+    """
     EPS = 1e-9
-    def sub2(a,b): return (a[0]-b[0], a[1]-b[1])
-    def cross(a,b): return a[0]*b[1] - a[1]*b[0]
-    def add2(a,b): return (a[0]+b[0], a[1]+b[1])
-    def mul2(a,s): return (a[0]*s, a[1]*s)
-    r = sub2(p2, p)
-    s = sub2(q2, q)
-    rxs = cross(r, s)
-    qp = sub2(q, p)
-    if abs(rxs) < EPS:
-        return None
-    t = (qp[0]*s[1] - qp[1]*s[0]) / rxs
-    u = (qp[0]*r[1] - qp[1]*r[0]) / rxs
-    if -EPS <= t <= 1+EPS and -EPS <= u <= 1+EPS:
-        inter = add2(p, mul2(r, max(0.0, min(1.0, t))))
-        return inter, t, u
-    return None
-
-def _build_graph(polylines: List[List[Tuple[float,float]]]):
+    rx, ry = p2[..., 0] - p[..., 0], p2[..., 1] - p[..., 1]
+    sx, sy = q2[..., 0] - q[..., 0], q2[..., 1] - q[..., 1]
+    rxs = rx*sy - ry*sx
+    qpx, qpy = q[..., 0] - p[..., 0], q[..., 1] - p[..., 1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (qpx*sy - qpy*sx) / rxs
+        u = (qpx*ry - qpy*rx) / rxs
+        hit = (np.abs(rxs) >= EPS) & (t >= -EPS) & (t <= 1+EPS) & (u >= -EPS) & (u <= 1+EPS)
+    return hit, t, u
+
+def _candidate_edge_pairs(segs: np.ndarray) -> np.ndarray:
+    """
+    Broad phase for intersection splitting: every pair (i < j) of (ax, ay, bx, by)
+    rows whose bounding boxes overlap, as a (K, 2) array sorted by (i, j). Boxes
+    are padded slightly beyond `_seg_intersections`' EPS tolerance, so no pair
+    that the narrow phase would accept is dropped. Boxes are bucketed into a
+    uniform grid and pairs are generated per cell with array operations.
+    """
+    n = len(segs)
+    if n < 2:
+        return np.empty((0, 2), dtype=np.int64)
+    ax, ay, bx, by = segs[:, 0], segs[:, 1], segs[:, 2], segs[:, 3]
+    pad = 1e-6 * (1.0 + np.abs(bx - ax) + np.abs(by - ay))
+    x0, y0 = np.minimum(ax, bx) - pad, np.minimum(ay, by) - pad
+    x1, y1 = np.maximum(ax, bx) + pad, np.maximum(ay, by) + pad
+    # roughly one average edge per cell keeps buckets small without
+    # registering long edges in too many cells
+    cell = max(float(np.maximum(np.abs(bx - ax), np.abs(by - ay)).sum()) / n, 1e-3)
+    cx0, cx1 = np.floor(x0 / cell).astype(np.int64), np.floor(x1 / cell).astype(np.int64)
+    cy0, cy1 = np.floor(y0 / cell).astype(np.int64), np.floor(y1 / cell).astype(np.int64)
+    w, h = cx1 - cx0 + 1, cy1 - cy0 + 1
+    # edges covering many cells (e.g. one long diagonal corridor) are checked
+    # against every box directly instead of being registered cell by cell
+    oversized = w * h > 64
+
+    def overlaps(i, j):
+        return ~((x0[i] > x1[j]) | (x0[j] > x1[i]) | (y0[i] > y1[j]) | (y0[j] > y1[i]))
+
+    found = []
+    for i in np.flatnonzero(oversized):
+        j = np.flatnonzero(overlaps(i, np.arange(n)))
+        # oversized/oversized pairs are reported once, from the smaller index
+        j = j[(j != i) & ~(oversized[j] & (j < i))]
+        found.append(np.stack([np.minimum(i, j), np.maximum(i, j)], axis=1))
+
+    # one (cell, edge) row per cell each regular box covers
+    reg = np.flatnonzero(~oversized)
+    counts = (w * h)[reg]
+    member = np.repeat(reg, counts)
+    k = np.arange(len(member)) - np.repeat(np.cumsum(counts) - counts, counts)
+    mcx = cx0[member] + k // h[member]
+    mcy = cy0[member] + k % h[member]
+    order = np.lexsort((member, mcy, mcx))
+    member, mcx, mcy = member[order], mcx[order], mcy[order]
+    # pair each row with the rows after it in the same cell
+    step = 1
+    while step < len(member):
+        same = (mcx[step:] == mcx[:-step]) & (mcy[step:] == mcy[:-step])
+        if not same.any():
+            break
+        at = np.flatnonzero(same)
+        i, j = member[at], member[at + step]
+        cxs, cys = mcx[at], mcy[at]
+        keep = overlaps(i, j)
+        # report each pair once: in the cell holding the overlap's min corner
+        keep &= (np.floor(np.maximum(x0[i], x0[j]) / cell) == cxs) & (np.floor(np.maximum(y0[i], y0[j]) / cell) == cys)
+        found.append(np.stack([i[keep], j[keep]], axis=1))
+        step += 1
+    pairs = np.concatenate(found) if found else np.empty((0, 2), dtype=np.int64)
+    return pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+
+def _polyline_pieces(polylines: Sequence) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Every piece (consecutive point pair) of the polylines as (S, 4) rows of
+    ax, ay, bx, by in polyline order, with each row's polyline index and piece
+    index. Polylines are (N, 2) arrays (blob views are used as they are) or
+    lists of (x, y).
+    """
+    lens = np.array([len(pl) for pl in polylines], dtype=np.int64)
+    counts = np.maximum(lens - 1, 0)
+    if not counts.sum():
+        return np.empty((0, 4)), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    if all(isinstance(pl, np.ndarray) for pl in polylines):
+        pts = np.concatenate(polylines).astype(np.float64, copy=False)
+    else:
+        pts = np.array([p for pl in polylines for p in pl], dtype=np.float64).reshape(-1, 2)
+    poly = np.repeat(np.arange(len(lens)), counts)
+    piece = np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts) - counts, counts)
+    # row of each piece's first point in pts
+    first = np.repeat(np.cumsum(lens) - lens, counts) + piece
+    return np.hstack((pts[first], pts[first + 1])), poly, piece
+
+def _build_graph(polylines: Sequence):
     coords_by_key: Dict[str, Tuple[float, float]] = {}
     graph: Dict[str, Dict[str, float]] = {}
     def ensure_node(pt: Tuple[float,float]) -> str:
@@ -107,32 +224,26 @@ def _build_graph(polylines: List[List[Tuple[float,float]]]):
         graph[ka][kb] = min(graph[ka].get(kb, float('inf')), w)
         graph[kb][ka] = min(graph[kb].get(ka, float('inf')), w)
 
-    # edges
-    edges = []
-    for pi, pl in enumerate(polylines):
-        for si in range(len(pl)-1):
-            edges.append((pi, si, pl[si], pl[si+1]))
-    # intersections
-    splits: Dict[Tuple[int,int], List[float]] = {}
-    for i in range(len(edges)):
-        pi, si, a1, b1 = edges[i]
-        for j in range(i+1, len(edges)):
-            pj, sj, a2, b2 = edges[j]
-            inter = _seg_intersection(a1, b1, a2, b2)
-            if inter is None:
-                continue
-            _, t1, t2 = inter
-            EPS = 1e-9
-            if EPS < t1 < 1.0-EPS:
-                splits.setdefault((pi, si), []).append(float(t1))
-            if EPS < t2 < 1.0-EPS:
-                splits.setdefault((pj, sj), []).append(float(t2))
+    # edges, one row per polyline piece
+    segs, _, _ = _polyline_pieces(polylines)
+    # intersections (only pairs whose bounding boxes overlap are tested), all at once
+    splits: Dict[int, List[float]] = {}
+    pairs = _candidate_edge_pairs(segs)
+    I, J = pairs[:, 0], pairs[:, 1]
+    hit, T1, T2 = _seg_intersections(segs[I, :2], segs[I, 2:], segs[J, :2], segs[J, 2:])
+    EPS = 1e-9
+    for i, j, t1, t2 in zip(I[hit].tolist(), J[hit].tolist(), T1[hit].tolist(), T2[hit].tolist()):
+        if EPS < t1 < 1.0-EPS:
+            splits.setdefault(i, []).append(t1)
+        if EPS < t2 < 1.0-EPS:
+            splits.setdefault(j, []).append(t2)
     # subdivide
-    for (pi, si, a, b) in edges:
-        r = (b[0]-a[0], b[1]-a[1])
+    for idx, (ax, ay, bx, by) in enumerate(segs.tolist()):
+        a = (ax, ay)
+        r = (bx-ax, by-ay)
         ts = [0.0, 1.0]
-        if (pi, si) in splits:
-            ts.extend(splits[(pi, si)])
+        if idx in splits:
+            ts.extend(splits[idx])
         ts = sorted(set(max(0.0, min(1.0, t)) for t in ts))
         prev = (a[0] + r[0]*ts[0], a[1] + r[1]*ts[0])
         for k in range(1, len(ts)):
@@ -147,12 +258,33 @@ def _connect_nearby_nodes(graph: Dict[str, Dict[str, float]], coords_by_key: Dic
     """
     Heuristic: endpoints that are extremely close (within eps pixels) should be
     considered connected. This helps when drawn segments didn't snap perfectly.
+    Candidates come from an eps-sized cell hash (own + 8 neighbouring cells), and
+    pairs are visited in the same (i, j) order as an all-pairs scan would.
     """
+    if eps <= 0:
+        return
     keys = list(coords_by_key.keys())
+    # a hair larger than eps so float rounding can't push a pair 2 cells apart
+    cell = eps * (1.0 + 1e-9)
+    cells: List[Tuple[int, int]] = []
+    buckets: Dict[Tuple[int, int], List[int]] = {}
+    for idx, k in enumerate(keys):
+        x, y = coords_by_key[k]
+        c = (math.floor(x / cell), math.floor(y / cell))
+        cells.append(c)
+        buckets.setdefault(c, []).append(idx)
     for i in range(len(keys)):
         ki = keys[i]
         xi, yi = coords_by_key[ki]
-        for j in range(i+1, len(keys)):
+        cx, cy = cells[i]
+        near: List[int] = []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for j in buckets.get((cx + dx, cy + dy), ()):
+                    if j > i:
+                        near.append(j)
+        near.sort()
+        for j in near:
             kj = keys[j]
             xj, yj = coords_by_key[kj]
             d = math.hypot(xi - xj, yi - yj)
@@ -164,61 +296,504 @@ def _connect_nearby_nodes(graph: Dict[str, Dict[str, float]], coords_by_key: Dic
                 graph[ki][kj] = min(graph[ki].get(kj, float('inf')), w)
                 graph[kj][ki] = min(graph[kj].get(ki, float('inf')), w)
 
-def _shortest_polyline_between(start: Tuple[float,float], end: Tuple[float,float], graph, coords_by_key, polylines, algorithm: str = "dijkstra"):
-    algo = (algorithm or "").lower()
+class _ArrayGraph(NamedTuple):
+    """
+    Compact CSR form of the walkable graph. Node ids are row indices into
+    `coords`; the neighbours of node u are targets[offsets[u]:offsets[u+1]] with
+    the matching `weights`. Plain NumPy arrays keep a cached mart graph small and
+    cheap to pickle.
+    """
+    coords: np.ndarray   # (N, 2) float64
+    offsets: np.ndarray  # (N+1,) int64
+    targets: np.ndarray  # (M,) int32
+    weights: np.ndarray  # (M,) float64
 
-    # snap endpoints
-    def best_projection(p):
-        best=None; best_d=float('inf')
-        for pl in polylines:
-            for i in range(len(pl)-1):
-                a=pl[i]; b=pl[i+1]
-                q,_=_project_point_to_segment(p,a,b)
-                d=_dist(p,q)
-                if d<best_d:
-                    best_d=d; best=(a,b,q)
-        return best
-    s_proj = best_projection(start)
-    e_proj = best_projection(end)
-    if not s_proj or not e_proj:
-        return [start, end]
-    (sa, sb, sq) = s_proj
-    (ea, eb, eq) = e_proj
-    S = "__S__"; E = "__E__"
-    graph.setdefault(S, {})
-    graph.setdefault(E, {})
-    def ensure_node(pt):
+
+def _to_array_graph(graph: Dict[str, Dict[str, float]], coords_by_key: Dict[str, Tuple[float, float]]) -> _ArrayGraph:
+    keys = list(coords_by_key.keys())
+    ids = {k: i for i, k in enumerate(keys)}
+    offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+    targets: List[int] = []
+    weights: List[float] = []
+    for i, k in enumerate(keys):
+        # keep the dict's insertion order so neighbour order is unchanged
+        for kb, w in graph.get(k, {}).items():
+            targets.append(ids[kb])
+            weights.append(w)
+        offsets[i + 1] = len(targets)
+    return _ArrayGraph(
+        coords=np.array([coords_by_key[k] for k in keys], dtype=np.float64).reshape(-1, 2),
+        offsets=offsets,
+        targets=np.array(targets, dtype=np.int32),
+        weights=np.array(weights, dtype=np.float64),
+    )
+
+
+class _SnapIndex:
+    """
+    Uniform-grid indexes over the polyline segments and graph nodes of one
+    compiled graph, so endpoint snapping and nearest-node lookups only visit the
+    cells around the query instead of scanning everything. Results (including
+    tie-breaking by polyline / node id order) match a full scan.
+    """
+    # candidate sets at least this large are projected in one NumPy call; below
+    # it the per-call overhead costs more than the scalar loop
+    BATCH_MIN = 64
+
+    def __init__(self, polylines: Sequence, coords: np.ndarray, seg_ids: Optional[List[int]] = None):
+        # (S, 4) rows of ax, ay, bx, by in polyline order
+        self.segments, poly, piece = _polyline_pieces(polylines)
+        segs = self.segments.tolist()
+        # row -> (segment row id or None, piece index within its polyline)
+        ids = seg_ids if seg_ids is not None else [None] * len(polylines)
+        self.owners = [(ids[p], i) for p, i in zip(poly.tolist(), piece.tolist())]
+        self.coords = coords
+        total = sum(max(abs(bx-ax), abs(by-ay)) for ax, ay, bx, by in segs)
+        self.cell = max(total / len(segs), 1e-3) if segs else 1.0
+        cell = self.cell
+        xs = [p[0] for p in coords.tolist()] + [c for s in segs for c in (s[0], s[2])]
+        ys = [p[1] for p in coords.tolist()] + [c for s in segs for c in (s[1], s[3])]
+        if xs:
+            self.bounds = (math.floor(min(xs) / cell), math.floor(min(ys) / cell),
+                           math.floor(max(xs) / cell), math.floor(max(ys) / cell))
+        else:
+            self.bounds = (0, 0, -1, -1)
+        self.seg_buckets: Dict[Tuple[int, int], List[int]] = {}
+        # long segments spanning many cells are always tested directly
+        self.seg_oversized: List[int] = []
+        for idx, (ax, ay, bx, by) in enumerate(segs):
+            cx0, cx1 = math.floor(min(ax, bx) / cell), math.floor(max(ax, bx) / cell)
+            cy0, cy1 = math.floor(min(ay, by) / cell), math.floor(max(ay, by) / cell)
+            if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > 64:
+                self.seg_oversized.append(idx)
+                continue
+            for cx in range(cx0, cx1 + 1):
+                for cy in range(cy0, cy1 + 1):
+                    self.seg_buckets.setdefault((cx, cy), []).append(idx)
+        self.node_buckets: Dict[Tuple[int, int], List[int]] = {}
+        for idx, (x, y) in enumerate(coords.tolist()):
+            self.node_buckets.setdefault((math.floor(x / cell), math.floor(y / cell)), []).append(idx)
+
+    def _rings(self, p: Tuple[float, float]):
+        """Yield (r, cells) for Chebyshev rings around p's cell, clipped to the index bounds."""
+        gx0, gy0, gx1, gy1 = self.bounds
+        if gx1 < gx0:
+            return
+        qx, qy = math.floor(p[0] / self.cell), math.floor(p[1] / self.cell)
+        r0 = max(gx0 - qx, qx - gx1, gy0 - qy, qy - gy1, 0)
+        r_max = max(abs(qx - gx0), abs(qx - gx1), abs(qy - gy0), abs(qy - gy1))
+        for r in range(r0, r_max + 1):
+            cells = []
+            x_lo, x_hi = max(qx - r, gx0), min(qx + r, gx1)
+            for cy in (qy - r, qy + r) if r else (qy,):
+                if gy0 <= cy <= gy1:
+                    cells.extend((cx, cy) for cx in range(x_lo, x_hi + 1))
+            for cx in (qx - r, qx + r) if r else ():
+                if gx0 <= cx <= gx1:
+                    cells.extend((cx, cy) for cy in range(max(qy - r + 1, gy0), min(qy + r - 1, gy1) + 1))
+            yield r, cells
+
+    def segment(self, idx: int) -> Tuple[Tuple[float, float], Tuple[float, float]]:
+        ax, ay, bx, by = self.segments[idx].tolist()
+        return (ax, ay), (bx, by)
+
+    def nearest_segment(self, p: Tuple[float, float]) -> Optional[Tuple[Tuple[float, float], Tuple[float, float], Tuple[float, float]]]:
+        """Closest segment to p as (a, b, projection), or None without segments."""
+        found = self._nearest(p)
+        if found is None:
+            return None
+        a, b = self.segment(found[0])
+        return a, b, found[1]
+
+    def anchor(self, p: Tuple[float, float]) -> Optional[Tuple[Optional[int], int, float, Tuple[float, float], Tuple[float, float], Tuple[float, float]]]:
+        """Like nearest_segment, as (segment id, piece index, t, a, b, projection)."""
+        found = self._nearest(p)
+        if found is None:
+            return None
+        idx, q = found
+        a, b = self.segment(idx)
+        _, t = _project_point_to_segment(q, a, b)
+        sid, piece = self.owners[idx]
+        return sid, piece, t, a, b, q
+
+    def _nearest(self, p: Tuple[float, float]) -> Optional[Tuple[int, Tuple[float, float]]]:
+        sv = memoryview(self.segments.reshape(-1))
+        best_d = float('inf'); best_idx = -1; best_q = None
+        def test(idxs: List[int]):
+            # ties go to the lowest row
+            nonlocal best_d, best_idx, best_q
+            if len(idxs) < self.BATCH_MIN:
+                for idx in idxs:
+                    o = 4 * idx
+                    q, _ = _project_point_to_segment(p, (sv[o], sv[o+1]), (sv[o+2], sv[o+3]))
+                    d = _dist(p, q)
+                    if d < best_d or (d == best_d and idx < best_idx):
+                        best_d = d; best_idx = idx; best_q = q
+                return
+            rows = np.array(sorted(idxs))
+            qx, qy, _ = _project_point_to_segments(p, self.segments[rows])
+            d = np.hypot(p[0] - qx, p[1] - qy)
+            k = int(np.argmin(d))
+            if d[k] < best_d or (d[k] == best_d and rows[k] < best_idx):
+                best_d = float(d[k]); best_idx = int(rows[k]); best_q = (float(qx[k]), float(qy[k]))
+        test(self.seg_oversized)
+        seen = set()
+        for r, cells in self._rings(p):
+            batch = []
+            for c in cells:
+                for idx in self.seg_buckets.get(c, ()):
+                    if idx not in seen:
+                        seen.add(idx)
+                        batch.append(idx)
+            test(batch)
+            # anything in ring r+1 is at least r cells away
+            if best_d < r * self.cell:
+                break
+        if best_idx < 0:
+            return None
+        return best_idx, best_q
+
+    def nodes_near_segment(self, a: Tuple[float, float], b: Tuple[float, float], tol: float) -> List[int]:
+        """Ids (ascending) of nodes inside the segment's bounding box padded by tol."""
+        cell = self.cell
+        xy = memoryview(self.coords.reshape(-1))
+        x0, x1 = min(a[0], b[0]) - tol, max(a[0], b[0]) + tol
+        y0, y1 = min(a[1], b[1]) - tol, max(a[1], b[1]) + tol
+        gx0, gy0, gx1, gy1 = self.bounds
+        out: List[int] = []
+        for cx in range(max(math.floor(x0 / cell), gx0), min(math.floor(x1 / cell), gx1) + 1):
+            for cy in range(max(math.floor(y0 / cell), gy0), min(math.floor(y1 / cell), gy1) + 1):
+                for idx in self.node_buckets.get((cx, cy), ()):
+                    x, y = xy[2*idx], xy[2*idx+1]
+                    if x0 <= x <= x1 and y0 <= y <= y1:
+                        out.append(idx)
+        out.sort()
+        return out
+
+    def find_node(self, pt: Tuple[float, float]) -> Optional[int]:
+        """Id of the node whose `_qkey` equals pt's, if any."""
+        key = _qkey(pt[0], pt[1])
+        xy = memoryview(self.coords.reshape(-1))
+        for idx in self.nodes_near_segment(pt, pt, 1e-3):
+            if _qkey(xy[2*idx], xy[2*idx+1]) == key:
+                return idx
+        return None
+
+    def nearest_nodes(self, p: Tuple[float, float], k: int) -> List[Tuple[float, int]]:
+        """The k closest nodes to p as sorted (distance, id) pairs."""
+        xy = memoryview(self.coords.reshape(-1))
+        found: List[Tuple[float, int]] = []
+        for r, cells in self._rings(p):
+            for c in cells:
+                for idx in self.node_buckets.get(c, ()):
+                    found.append((_dist(p, (xy[2*idx], xy[2*idx+1])), idx))
+            if len(found) >= k:
+                found.sort()
+                del found[k:]
+                if found[-1][0] < r * self.cell:
+                    break
+        found.sort()
+        return found[:k]
+
+
+class _ItemLegCache:
+    """
+    Walking legs between items on one compiled graph, as
+    rows[from_id][to_id] = (distance, polyline). It is dropped together with the
+    graph when segments change, and emptied when the item version moves.
+
+    Route pool threads share it, so every operation holds `lock`; legs computed
+    for an item version that has moved on meanwhile are not stored.
+    """
+    MAX_ROWS = 1024
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = -1
+        self.rows: Dict[int, Dict[int, Tuple[float, List[Tuple[float, float]]]]] = {}
+
+    def __reduce__(self):
+        # per-process cache (and locks do not pickle): pool processes start empty
+        return (type(self), ())
+
+    def sync(self, version: int) -> None:
+        with self.lock:
+            if version != self.version:
+                self.rows = {}
+                self.version = version
+
+    def get(self, a: int, b: int) -> Optional[Tuple[float, List[Tuple[float, float]]]]:
+        with self.lock:
+            return self.rows.get(a, {}).get(b)
+
+    def put(self, a: int, b: int, leg: Tuple[float, List[Tuple[float, float]]], version: int) -> None:
+        with self.lock:
+            if version != self.version:
+                return
+            if a not in self.rows and len(self.rows) >= self.MAX_ROWS:
+                # evict the oldest source row
+                self.rows.pop(next(iter(self.rows)), None)
+            self.rows.setdefault(a, {})[b] = leg
+
+
+class _CompiledGraph(NamedTuple):
+    graph: _ArrayGraph
+    index: _SnapIndex
+    item_legs: _ItemLegCache
+    dest_trees: "_DestTreeCache"
+    # (k, N) landmark distance table for ALT heuristics, or None when disabled
+    landmarks: Optional[np.ndarray]
+
+    @property
+    def has_segments(self) -> bool:
+        return len(self.index.segments) > 0
+
+
+def _compile_graph(polylines: Sequence, eps: float, seg_ids: Optional[List[int]] = None) -> _CompiledGraph:
+    graph, coords_by_key = _build_graph(polylines)
+    # Connect very-near nodes to bridge tiny gaps between drawn segments
+    _connect_nearby_nodes(graph, coords_by_key, eps=eps)
+    arrays = _to_array_graph(graph, coords_by_key)
+    landmarks = _select_landmarks(arrays, settings.ROUTE_ALT_LANDMARKS)
+    return _freeze(_CompiledGraph(arrays, _SnapIndex(polylines, arrays.coords, seg_ids), _ItemLegCache(), _DestTreeCache(), landmarks))
+
+
+def _freeze(compiled: _CompiledGraph) -> _CompiledGraph:
+    """
+    Cached graphs are shared by concurrent requests: make accidental writes fail
+    loudly. (Needed again after a graph comes back pickled from a pool process.)
+    """
+    for arr in (*compiled.graph, compiled.landmarks):
+        if arr is not None:
+            arr.flags.writeable = False
+    return compiled
+
+
+def _shippable(compiled: _CompiledGraph) -> _CompiledGraph:
+    """Copy of a compiled graph for a route pool process: same arrays, empty per-process caches."""
+    return compiled._replace(item_legs=_ItemLegCache(), dest_trees=_DestTreeCache())
+
+
+def _select_landmarks(g: _ArrayGraph, k: int) -> Optional[np.ndarray]:
+    """
+    Landmark distance table for ALT (A*, landmarks, triangle inequality): a (k, N)
+    array of shortest distances from k landmarks. Landmarks are picked by
+    farthest-point selection so they sit on the edges of the map, and nodes that
+    no landmark reaches (another disconnected part) are picked first.
+    Returns None when disabled or the graph is empty.
+    """
+    n = len(g.offsets) - 1
+    if k <= 0 or n == 0:
+        return None
+    # the first landmark is the node farthest from an arbitrary one
+    far = np.asarray(_csr_search(g, {}, n, 0, ())[0])
+    nxt = int(np.where(np.isfinite(far), far, -1.0).argmax())
+    nearest = np.full(n, np.inf)
+    rows = []
+    for _ in range(min(k, n)):
+        d = np.asarray(_csr_search(g, {}, n, nxt, ())[0])
+        rows.append(d)
+        nearest = np.minimum(nearest, d)
+        nxt = int(nearest.argmax())
+        if nearest[nxt] <= 0.0:
+            break
+    return np.vstack(rows)
+
+
+def _csr_search(g: _ArrayGraph, extra: Dict[int, Dict[int, float]], n_total: int, src: int, targets, h=None) -> Tuple[List[float], List[int]]:
+    """
+    Dijkstra from src over the CSR graph plus per-query `extra` adjacency for
+    virtual nodes (ids >= N), stopping once every id in `targets` is settled.
+    With an admissible heuristic `h(node_id)` (single target only) this is A*.
+    Returns (dist, prev); prev[t] == -1 means t was not reached.
+    """
+    remaining = set(targets)
+    remaining.discard(src)
+    n_base = len(g.offsets) - 1
+    offs = memoryview(g.offsets); tgt = memoryview(g.targets); wts = memoryview(g.weights)
+    INF = float('inf')
+    dist = [INF] * n_total
+    prev = [-1] * n_total
+    done = bytearray(n_total)
+    dist[src] = 0.0
+    pq = [(h(src) if h else 0.0, 0.0, src)]  # (f, g, node)
+    while pq:
+        _, d, u = heapq.heappop(pq)
+        if done[u]:
+            continue
+        done[u] = 1
+        if u in remaining:
+            remaining.discard(u)
+            if not remaining:
+                break
+        if u < n_base:
+            for k in range(offs[u], offs[u+1]):
+                v = tgt[k]
+                nd = d + wts[k]
+                if nd < dist[v]:
+                    # reopen v if it was settled too early (only possible with
+                    # an admissible but inconsistent heuristic)
+                    dist[v] = nd; prev[v] = u; done[v] = 0
+                    heapq.heappush(pq, (nd + h(v) if h else nd, nd, v))
+        ex = extra.get(u)
+        if ex:
+            for v, w in ex.items():
+                nd = d + w
+                if nd < dist[v]:
+                    dist[v] = nd; prev[v] = u; done[v] = 0
+                    heapq.heappush(pq, (nd + h(v) if h else nd, nd, v))
+    return dist, prev
+
+
+def _mart_scope(column, mart_id: Optional[int]):
+    """Rows of one mart plus legacy rows without a mart."""
+    return or_(column == mart_id, column.is_(None))
+
+
+# segment geometry columns: the packed blob, and the JSON text only for rows
+# that have no blob yet, so migrated rows never ship their text
+_SEGMENT_GEOMETRY = (
+    Segment.polyline_blob,
+    case((Segment.polyline_blob.is_(None), Segment.polyline_json), else_=None),
+)
+
+
+def _segment_array(blob: Optional[bytes], raw_json: Optional[str]) -> np.ndarray:
+    """(N, 2) points of a segment row: a read-only view of its packed blob when present, else parsed from its JSON text."""
+    arr = polyline_codec.from_blob(blob)
+    if arr is not None:
+        return arr
+    return np.array([(float(p["x"]), float(p["y"])) for p in json.loads(raw_json)], dtype=np.float64).reshape(-1, 2)
+
+
+def _segment_points(blob: Optional[bytes], raw_json: Optional[str]) -> List[Tuple[float, float]]:
+    """Points of a segment row as (x, y) tuples, for polylines that end up in responses."""
+    arr = polyline_codec.from_blob(blob)
+    if arr is not None:
+        return list(map(tuple, arr.tolist()))
+    return [(float(p["x"]), float(p["y"])) for p in json.loads(raw_json)]
+
+
+async def _load_polylines(db: AsyncSession, mart_id: Optional[int] = None, floor: Optional[float] = None) -> Tuple[List[int], List[np.ndarray]]:
+    """
+    Segment row ids and their (N, 2) point arrays (rows without a usable polyline
+    are skipped). Blob rows stay views of the fetched bytes; the graph build reads
+    them with array operations.
+    """
+    stmt = select(Segment.id, *_SEGMENT_GEOMETRY)
+    if mart_id is not None:
+        stmt = stmt.where(_mart_scope(Segment.mart_id, mart_id))
+    if floor is not None:
+        on_floor = Segment.z == floor
+        stmt = stmt.where(or_(on_floor, Segment.z.is_(None)) if floor == _FLOOR0 else on_floor)
+    res = await db.execute(stmt)
+    ids: List[int] = []
+    polylines: List[np.ndarray] = []
+    for sid, blob, raw_json in res.all():
+        try:
+            pts = _segment_array(blob, raw_json)
+            if len(pts) >= 2:
+                ids.append(sid)
+                polylines.append(pts)
+        except Exception:
+            continue
+    return ids, polylines
+
+
+async def _snap_eps(db: AsyncSession, mart_id: Optional[int]) -> float:
+    if mart_id is not None:
+        mart = await db.get(Mart, mart_id)
+        if mart is not None and mart.route_snap_eps is not None:
+            return float(mart.route_snap_eps)
+    return float(settings.ROUTE_SNAP_EPS)
+
+
+async def _get_compiled_graph(db: AsyncSession, mart_id: Optional[int] = None, floor: Optional[float] = None) -> _CompiledGraph:
+    """
+    Return the walkable graph of one mart's segments (all segments when mart_id is
+    None), building it only when the mart's route_version changed since the cached
+    copy was compiled. With a floor only that floor's segments are used, so every
+    floor of a multi-floor mart is cached and searched on its own.
+    """
+    key = mart_id if floor is None else (mart_id, floor)
+    version, _ = await catalog_version.route_versions(db, mart_id)
+
+    async def build() -> _CompiledGraph:
+        eps = await _snap_eps(db, mart_id)
+        seg_ids, polylines = await _load_polylines(db, mart_id, floor)
+        return _freeze(await route_pool.run(_compile_graph, polylines, eps, seg_ids))
+
+    return await graph_cache.get_or_build(key, version, build)
+
+
+class _QueryOverlay:
+    """
+    Per-query virtual nodes and edges layered over a read-only compiled graph.
+
+    Virtual ids start at N (the base node count). Edges touching them, and the
+    extra split edges on base nodes, live in a small dict that is thrown away
+    with the overlay. The shared CSR arrays are never written, so concurrent
+    queries can use the same cached graph and there is nothing to clean up.
+    """
+    def __init__(self, compiled: _CompiledGraph):
+        self.graph = compiled.graph
+        self.index = compiled.index
+        self.landmarks = compiled.landmarks
+        # set once straight-line fallback edges exist; they can be shorter than the
+        # network path between two base nodes, which voids landmark bounds
+        self.shortcuts = False
+        self.n_base = len(self.graph.offsets) - 1
+        self._xy = memoryview(self.graph.coords.reshape(-1))
+        self.virtual: List[Tuple[float, float]] = []
+        self._virtual_by_key: Dict[str, int] = {}
+        self.extra: Dict[int, Dict[int, float]] = {}
+        # virtual nodes that stand for points on the network, in creation order
+        self.extra_ids: List[int] = []
+        # attached query point -> (projection node, projection point)
+        self.proj: Dict[int, Tuple[int, Tuple[float, float]]] = {}
+
+    @property
+    def n_total(self) -> int:
+        return self.n_base + len(self.virtual)
+
+    def coord(self, i: int) -> Tuple[float, float]:
+        if i < self.n_base:
+            return (self._xy[2*i], self._xy[2*i+1])
+        return self.virtual[i - self.n_base]
+
+    def new_node(self, pt: Tuple[float, float]) -> int:
+        self.virtual.append(pt)
+        return self.n_total - 1
+
+    def ensure_node(self, pt: Tuple[float, float]) -> int:
+        """Base node with pt's `_qkey`, or a (shared) virtual node for it."""
+        i = self.index.find_node(pt)
+        if i is not None:
+            return i
         k = _qkey(pt[0], pt[1])
-        coords_by_key.setdefault(k, pt)
-        graph.setdefault(k, {})
-        return k
-    sa_k = ensure_node(sa); sb_k=ensure_node(sb); ea_k=ensure_node(ea); eb_k=ensure_node(eb)
-    # Insert projection nodes on the segments themselves to avoid long detours to endpoints
-    sq_k = ensure_node(sq)
-    eq_k = ensure_node(eq)
-    def add_edge(ka,kb,w):
-        graph.setdefault(ka,{}); graph.setdefault(kb,{})
-        graph[ka][kb]=min(graph[ka].get(kb,float('inf')),w)
-        graph[kb][ka]=min(graph[kb].get(ka,float('inf')),w)
-    # Connect projection nodes along their segments (split edges)
-    add_edge(sa_k, sq_k, _dist(sa, sq))
-    add_edge(sq_k, sb_k, _dist(sq, sb))
-    add_edge(ea_k, eq_k, _dist(ea, eq))
-    add_edge(eq_k, eb_k, _dist(eq, eb))
-
-    # Additionally, connect projection nodes to any existing graph vertices that lie
-    # on the same geometric segment, so the path can enter/exit mid-segment without
-    # detouring to endpoints.
-    def _connect_proj_to_segment_nodes(proj_pt: Tuple[float,float], a: Tuple[float,float], b: Tuple[float,float], proj_key: str):
+        if k not in self._virtual_by_key:
+            self._virtual_by_key[k] = self.new_node(pt)
+            self.extra_ids.append(self._virtual_by_key[k])
+        return self._virtual_by_key[k]
+
+    def add_edge(self, ka: int, kb: int, w: float) -> None:
+        if ka == kb:
+            return
+        self.extra.setdefault(ka, {}); self.extra.setdefault(kb, {})
+        self.extra[ka][kb] = min(self.extra[ka].get(kb, float('inf')), w)
+        self.extra[kb][ka] = min(self.extra[kb].get(ka, float('inf')), w)
+
+    def _connect_proj_to_segment_nodes(self, proj_pt: Tuple[float,float], a: Tuple[float,float], b: Tuple[float,float], proj_key: int):
         # Parameter t for projection itself along AB
         _, t_proj = _project_point_to_segment(proj_pt, a, b)
         seg_len = _dist(a, b)
         if seg_len <= 1e-9:
             return
-        for key, pt in list(coords_by_key.items()):
-            # Skip S/E special nodes (not in coords_by_key anyway) and self
+        for key in self.index.nodes_near_segment(a, b, 1e-3) + self.extra_ids:
+            # Skip self
             if key == proj_key:
                 continue
+            pt = self.coord(key)
             # Check if pt lies on segment AB (within small perpendicular tolerance)
             q, t = _project_point_to_segment(pt, a, b)
             # Only consider interior points (exclude endpoints, which are already connected)
@@ -228,114 +803,706 @@ def _shortest_polyline_between(start: Tuple[float,float], end: Tuple[float,float
             if _dist(q, pt) <= 1e-4:
                 # Connect along-the-segment distance between projection and pt
                 w = abs(t - t_proj) * seg_len
-                add_edge(proj_key, key, w)
-
-    _connect_proj_to_segment_nodes(sq, sa, sb, sq_k)
-    _connect_proj_to_segment_nodes(eq, ea, eb, eq_k)
-
-    # Connect S/E to projection nodes using perpendicular distances
-    s_to_sq=_dist(start,sq); e_to_eq=_dist(end,eq)
-    via_S={sq_k:sq}
-    via_E={eq_k:eq}
-    add_edge(S, sq_k, s_to_sq)
-    add_edge(eq_k, E, e_to_eq)
-    # shortest path (Dijkstra or A*)
-    def dijkstra_search():
-        pq=[(0.0,S)]; dist_map={S:0.0}; prev={S:None}; vis=set()
+                self.add_edge(proj_key, key, w)
+
+    def attach(self, points: List[Tuple[float, float]], snapped: Optional[List] = None) -> Optional[List[int]]:
+        """
+        Snap free points onto their nearest segments and return one virtual node
+        per point, or None when the graph has no segments. `snapped` may give a
+        known (a, b, projection) per point (None = snap it here).
+        """
+        snapped = snapped or [None] * len(points)
+        projs = [pr if pr is not None else self.index.nearest_segment(p) for p, pr in zip(points, snapped)]
+        if any(pr is None for pr in projs):
+            return None
+        nodes = [self.new_node(p) for p in points]
+        ends = [(self.ensure_node(a), self.ensure_node(b)) for (a, b, _) in projs]
+        # Insert projection nodes on the segments themselves to avoid long detours to endpoints
+        qs = [self.ensure_node(q) for (_, _, q) in projs]
+        # Connect projection nodes along their segments (split edges)
+        for (a, b, q), (ka, kb), kq in zip(projs, ends, qs):
+            self.add_edge(ka, kq, _dist(a, q))
+            self.add_edge(kq, kb, _dist(q, b))
+        # Additionally, connect projection nodes to any existing graph vertices that lie
+        # on the same geometric segment, so the path can enter/exit mid-segment without
+        # detouring to endpoints.
+        for (a, b, q), kq in zip(projs, qs):
+            self._connect_proj_to_segment_nodes(q, a, b, kq)
+        # Connect the points to their projection nodes using perpendicular distances
+        for p, node, (_, _, q), kq in zip(points, nodes, projs, qs):
+            self.add_edge(node, kq, _dist(p, q))
+            self.proj[node] = (kq, q)
+        return nodes
+
+    def attach_nearest(self, node: int, k: int = 3) -> None:
+        """Fallback snap: link an attached point straight to its k nearest graph nodes."""
+        p = self.coord(node)
+        found = self.index.nearest_nodes(p, k) + [(_dist(p, self.coord(i)), i) for i in self.extra_ids]
+        found.sort()
+        for d, i in found[:k]:
+            self.add_edge(node, i, d)
+        self.shortcuts = True
+
+    def _portals(self, node: int) -> Dict[int, float]:
+        """Base nodes reachable from `node` through virtual nodes only, with their distances."""
+        if node < self.n_base:
+            return {node: 0.0}
+        best = {node: 0.0}
+        out: Dict[int, float] = {}
+        pq = [(0.0, node)]
         while pq:
-            d,u=heapq.heappop(pq)
-            if u in vis: continue
-            vis.add(u)
-            if u==E: break
-            for v,w in graph.get(u,{}).items():
-                nd=d+w
-                if nd < dist_map.get(v,float('inf')):
-                    dist_map[v]=nd; prev[v]=u; heapq.heappush(pq,(nd,v))
-        return prev
-    def astar_search():
-        # heuristic = Euclidean distance to end point (eq)
-        def h(key: str) -> float:
-            if key == E:
-                return 0.0
-            if key == S:
-                return _dist(start, end)
-            p = coords_by_key.get(key)
-            if p is None:
-                return 0.0
-            return _dist(p, end)
-        open_pq=[(h(S), 0.0, S)]  # (f, g, node)
-        g_map={S:0.0}; prev={S:None}
-        closed=set()
-        while open_pq:
-            f,g,u=heapq.heappop(open_pq)
-            if u in closed:
+            d, u = heapq.heappop(pq)
+            if d > best[u]:
                 continue
-            closed.add(u)
-            if u==E:
-                break
-            for v,w in graph.get(u,{}).items():
-                tentative=g+w
-                if tentative < g_map.get(v, float('inf')):
-                    g_map[v]=tentative
-                    prev[v]=u
-                    heapq.heappush(open_pq, (tentative + h(v), tentative, v))
-        return prev
+            if u < self.n_base:
+                out[u] = d
+                continue
+            for v, w in self.extra.get(u, {}).items():
+                nd = d + w
+                if nd < best.get(v, float('inf')):
+                    best[v] = nd
+                    heapq.heappush(pq, (nd, v))
+        return out
+
+    def heuristic(self, dst: int):
+        """
+        A* heuristic towards dst. Straight-line distance, raised on base nodes to
+        the landmark bound max_L |d(L, dst) - d(L, v)| when a landmark table is
+        available. d(L, dst) is exact: any path into dst leaves the base graph at
+        one of its portals.
+        """
+        target = self.coord(dst)
+        euclid = lambda i: _dist(self.coord(i), target)
+        if self.landmarks is None or self.shortcuts:
+            return euclid
+        portals = self._portals(dst)
+        if not portals:
+            return euclid
+        lm = self.landmarks
+        to_dst = (lm[:, list(portals)] + np.fromiter(portals.values(), float)).min(axis=1)
+        usable = np.isfinite(to_dst)
+        if not usable.any():
+            return euclid
+        with np.errstate(invalid='ignore'):
+            diff = np.abs(lm[usable] - to_dst[usable, None])
+        # a landmark that does not reach v says nothing about it
+        diff[~np.isfinite(diff)] = 0.0
+        xy = self.graph.coords
+        bound = np.maximum(diff.max(axis=0), np.hypot(xy[:, 0] - target[0], xy[:, 1] - target[1]))
+        hv = memoryview(bound)
+        n_base = self.n_base
+        return lambda i: hv[i] if i < n_base else euclid(i)
+
+    def search(self, src: int, dst: int, astar: bool = False) -> List[int]:
+        h = self.heuristic(dst) if astar else None
+        return _csr_search(self.graph, self.extra, self.n_total, src, (dst,), h)[1]
+
+    def search_many(self, src: int, targets: List[int]) -> Tuple[List[float], List[int]]:
+        """One Dijkstra tree from src, grown until every target is settled."""
+        return _csr_search(self.graph, self.extra, self.n_total, src, targets)
+
+    def polyline(self, prev: List[int], src: int, dst: int) -> Optional[List[Tuple[float, float]]]:
+        """Points from src to dst along `prev`, including the snap projections; None if unreached."""
+        if prev[dst] < 0:
+            return None
+        path = []; cur = dst
+        while cur >= 0:
+            path.append(cur); cur = prev[cur]
+        path.reverse()
+        out = [self.coord(src)]
+        for u, v in zip(path, path[1:]):
+            if u == src:
+                if src in self.proj and v == self.proj[src][0]:
+                    out.append(self.proj[src][1])
+                if v != dst:
+                    out.append(self.coord(v))
+            elif v == dst:
+                out.append(self.coord(u))
+                if dst in self.proj and u == self.proj[dst][0]:
+                    out.append(self.proj[dst][1])
+                out.append(self.coord(dst))
+            else:
+                out.append(self.coord(v))
+        # dedup
+        cleaned = []
+        for p in out:
+            if not cleaned or abs(cleaned[-1][0]-p[0]) > 1e-6 or abs(cleaned[-1][1]-p[1]) > 1e-6:
+                cleaned.append(p)
+        return cleaned
+
+
+def _shortest_polyline_between(start: Tuple[float,float], end: Tuple[float,float], compiled: _CompiledGraph, algorithm: str = "dijkstra"):
+    astar = (algorithm or "").lower() == "astar"
+    overlay = _QueryOverlay(compiled)
+    # snap endpoints
+    nodes = overlay.attach([start, end])
+    if nodes is None:
+        return [start, end]
+    S, E = nodes
+    prev = overlay.search(S, E, astar)
+    if prev[E] < 0:
+        # Fallback snap: if projection nodes still don't reach the graph (e.g. start/end
+        # slightly off drawn segments), connect to a few nearest graph nodes and retry.
+        overlay.attach_nearest(S)
+        overlay.attach_nearest(E)
+        prev = overlay.search(S, E, astar)
+    return overlay.polyline(prev, S, E) or [start, end]
 
-    def _run_search():
-        return astar_search() if algo == "astar" else dijkstra_search()
 
-    prev = _run_search()
+class _DestTree:
+    """
+    Shortest-path tree rooted at one destination point: the walking distance to
+    it and the next hop towards it from every node. The graph is undirected, so
+    one Dijkstra from the destination gives both.
+    """
+    def __init__(self, compiled: _CompiledGraph, end: Tuple[float, float]):
+        self.overlay = _QueryOverlay(compiled)
+        nodes = self.overlay.attach([end])
+        self.root = nodes[0] if nodes else -1
+        self.dist = array('d')
+        self.next = array('l')
+        if self.root >= 0:
+            dist, prev = self.overlay.search_many(self.root, [])
+            self.dist = array('d', dist)
+            self.next = array('l', prev)
+
+    def route(self, start: Tuple[float, float]) -> Optional[List[Tuple[float, float]]]:
+        """
+        Polyline from start to the root: snap start onto its nearest segment, pick
+        the best node reachable along that segment, then follow next hops. None if
+        the snapped segment does not reach the root.
+        """
+        if self.root < 0:
+            return None
+        ov = self.overlay
+        proj = ov.index.nearest_segment(start)
+        if proj is None:
+            return None
+        a, b, q = proj
+        # nodes the projection connects to, as (node, distance along the segment),
+        # exactly as _QueryOverlay.attach would link them
+        cands = [(ov.index.find_node(a), _dist(q, a)), (ov.index.find_node(b), _dist(q, b)),
+                 (ov.index.find_node(q), 0.0)]
+        seg_len = _dist(a, b)
+        if seg_len > 1e-9:
+            _, t_q = _project_point_to_segment(q, a, b)
+            for key in ov.index.nodes_near_segment(a, b, 1e-3) + ov.extra_ids:
+                pt = ov.coord(key)
+                p2, t = _project_point_to_segment(pt, a, b)
+                if 1e-6 < t < 1.0 - 1e-6 and _dist(p2, pt) <= 1e-4:
+                    cands.append((key, abs(t - t_q) * seg_len))
+        best, via = float('inf'), -1
+        for key, along in cands:
+            if key is not None and along + self.dist[key] < best:
+                best, via = along + self.dist[key], key
+        if via < 0 or best == float('inf'):
+            return None
+        out = [start, q]
+        while via >= 0:
+            out.append(ov.coord(via))
+            via = self.next[via]
+        cleaned: List[Tuple[float, float]] = []
+        for p in out:
+            if not cleaned or abs(cleaned[-1][0]-p[0]) > 1e-6 or abs(cleaned[-1][1]-p[1]) > 1e-6:
+                cleaned.append(p)
+        return cleaned
+
+
+class _DestTreeCache:
+    """
+    LRU of destination trees on one compiled graph (so they go away with it when
+    segments change). A destination gets a tree the second time it is routed to,
+    e.g. when a shopper who drifted off route asks again, so one-off queries keep
+    the cheaper point-to-point search.
+
+    Route pool threads share it: the LRU bookkeeping holds `lock`, the tree
+    itself is built outside it (two threads may build the same tree; the last
+    one is kept).
+    """
+    MAX_SEEN = 1024
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.trees: "OrderedDict[str, _DestTree]" = OrderedDict()
+        self.seen: "OrderedDict[str, bool]" = OrderedDict()
+
+    def __reduce__(self):
+        return (type(self), ())
+
+    def lookup(self, compiled: _CompiledGraph, end: Tuple[float, float]) -> Optional[_DestTree]:
+        key = _qkey(end[0], end[1])
+        with self.lock:
+            tree = self.trees.get(key)
+            if tree is not None:
+                self.trees.move_to_end(key)
+                return tree
+            if settings.ROUTE_DEST_TREES <= 0:
+                return None
+            if self.seen.pop(key, None) is None:
+                self.seen[key] = True
+                if len(self.seen) > self.MAX_SEEN:
+                    self.seen.popitem(last=False)
+                return None
+        tree = _DestTree(compiled, end)
+        with self.lock:
+            self.trees[key] = tree
+            self.trees.move_to_end(key)
+            while len(self.trees) > settings.ROUTE_DEST_TREES:
+                self.trees.popitem(last=False)
+        return tree
+
+
+def _route_polyline(compiled: _CompiledGraph, start: Tuple[float, float], end: Tuple[float, float], algorithm: str = "astar") -> List[Tuple[float, float]]:
+    """Point-to-point route, answered from the destination's cached tree when it has one."""
+    tree = compiled.dest_trees.lookup(compiled, end)
+    if tree is not None:
+        poly = tree.route(start)
+        if poly is not None:
+            return poly
+    return _shortest_polyline_between(start, end, compiled, algorithm=algorithm)
+
+
+# keys of the free (non-item) start/end points in _network_legs
+_START = "start"
+_END = "end"
+
+
+def _anchor_on(compiled: _CompiledGraph, anchor):
+    """A stored (a, b, projection) item anchor if its segment piece is in `compiled`."""
+    if anchor is None:
+        return None
+    a, b, _ = anchor
+    # anchors of another floor's graph (or left over from an edit) do not match any node
+    if compiled.index.find_node(a) is None or compiled.index.find_node(b) is None:
+        return None
+    return anchor
 
-    if E not in prev:
-        # Fallback snap: if projection nodes still don't reach the graph (e.g. start/end
-        # slightly off drawn segments), connect to a few nearest graph nodes and retry.
-        near_start = sorted(coords_by_key.items(), key=lambda kv: _dist(start, kv[1]))[:3]
-        near_end = sorted(coords_by_key.items(), key=lambda kv: _dist(end, kv[1]))[:3]
-        for k, pt in near_start:
-            add_edge(S, k, _dist(start, pt))
-        for k, pt in near_end:
-            add_edge(k, E, _dist(end, pt))
-        prev = _run_search()
-
-    if E not in prev:
-        # cleanup before returning
-        for cleanup_key in (S, E, sq_k, eq_k):
-            graph.pop(cleanup_key, None)
-        for k in list(graph.keys()):
-            for cleanup_key in (S, E, sq_k, eq_k):
-                graph[k].pop(cleanup_key, None)
-        return [start, end]
-    # reconstruct
-    path=[]; cur=E
-    while cur is not None:
-        path.append(cur); cur=prev.get(cur)
-    path.reverse()
-    out=[start]
-    for i in range(len(path)-1):
-        u=path[i]; v=path[i+1]
-        if u==S:
-            proj=via_S.get(v)
-            if proj is not None: out.append(proj)
-            if v not in (S,E): out.append(coords_by_key[v])
-        elif v==E:
-            if u not in (S,E): out.append(coords_by_key[u])
-            proj=via_E.get(u)
-            if proj is not None: out.append(proj)
-            out.append(end)
-        else:
-            if v in coords_by_key: out.append(coords_by_key[v])
-    # cleanup: remove S/E and projection nodes from graph to avoid pollution
-    for cleanup_key in (S, E, sq_k, eq_k):
-        graph.pop(cleanup_key, None)
-    for k in list(graph.keys()):
-        for cleanup_key in (S, E, sq_k, eq_k):
-            graph[k].pop(cleanup_key, None)
-    # dedup
-    cleaned=[]
-    for p in out:
-        if not cleaned or abs(cleaned[-1][0]-p[0])>1e-6 or abs(cleaned[-1][1]-p[1])>1e-6:
-            cleaned.append(p)
-    return cleaned
+
+async def _load_anchors(db: AsyncSession, item_ids) -> Dict[int, Tuple[Tuple[float, float], Tuple[float, float], Tuple[float, float]]]:
+    """Stored anchors of the int keys in item_ids as item id -> (a, b, projection)."""
+    ids = [i for i in item_ids if isinstance(i, int)]
+    if not ids:
+        return {}
+    res = await db.execute(select(ItemAnchor).where(ItemAnchor.item_id.in_(ids)))
+    return {an.item_id: ((an.a_x, an.a_y), (an.b_x, an.b_y), (an.x, an.y)) for an in res.scalars().all()}
+
+
+def _anchor_points(compiled: _CompiledGraph, points: List[Tuple[float, float]]) -> List[Optional[Tuple]]:
+    """`compiled.index.anchor` of every point (runs in the route pool)."""
+    return [compiled.index.anchor(p) for p in points]
+
+
+async def refresh_item_anchors(db: AsyncSession, mart_id: Optional[int] = None, item_ids: Optional[List[int]] = None) -> None:
+    """
+    Recompute the stored anchors of the given items, or of every item in a mart
+    (every item when both are None), on the graph each item is routed on. The
+    snapping runs in the route pool, one batch per graph. Write endpoints do not
+    call this directly but queue it with anchor_refresh.schedule.
+    """
+    stmt = select(Item.id, Item.mart_id, Item.x, Item.y, Item.z)
+    if item_ids is not None:
+        stmt = stmt.where(Item.id.in_(item_ids))
+    elif mart_id is not None:
+        stmt = stmt.where(Item.mart_id == mart_id)
+    rows = (await db.execute(stmt)).all()
+    if not rows:
+        return
+    plans: Dict[Optional[int], _FloorPlan] = {}
+    # (mart, floor) -> [(item id, point)]
+    groups: Dict[Tuple[Optional[int], Optional[float]], List[Tuple[int, Tuple[float, float]]]] = {}
+    for iid, mid, x, y, z in rows:
+        if mid not in plans:
+            plans[mid] = await _get_floor_plan(db, mid)
+        groups.setdefault((mid, plans[mid].floor_of(z)), []).append((iid, (float(x), float(y))))
+    fresh: List[ItemAnchor] = []
+    for (mid, floor), members in groups.items():
+        compiled = await _get_compiled_graph(db, mid, floor)
+        found = await route_pool.run_on_graph(compiled, _anchor_points, [p for _, p in members], pack=_shippable)
+        for (iid, _), hit in zip(members, found):
+            if hit is None or hit[0] is None:
+                continue
+            sid, piece, t, a, b, q = hit
+            fresh.append(ItemAnchor(item_id=iid, segment_id=sid, seg_index=piece, t=t,
+                                    x=q[0], y=q[1], a_x=a[0], a_y=a[1], b_x=b[0], b_y=b[1]))
+    await db.execute(delete(ItemAnchor).where(ItemAnchor.item_id.in_([r[0] for r in rows])))
+    db.add_all(fresh)
+    await db.commit()
+
+
+def _polyline_length(pl: List[Tuple[float, float]]) -> float:
+    return sum(_dist(pl[i], pl[i+1]) for i in range(len(pl)-1))
+
+
+def _network_legs(compiled: _CompiledGraph, pos: Dict, pairs: List[Tuple], anchors: Optional[Dict] = None, item_version: int = 0) -> Dict[Tuple, Tuple[float, List[Tuple[float, float]]]]:
+    """
+    Walking (distance, polyline) for every (a, b) pair of keys in `pos`.
+    Item-to-item legs (int keys) come from the graph's item leg cache when
+    possible (it is reset when `item_version` moves); the rest are filled by one
+    one-to-many search per distinct source over a single overlay holding all
+    points, and item legs are stored back in both directions. Items with a
+    stored anchor on this graph are not snapped.
+
+    Runs in the route pool, so everything it needs comes in as arguments.
+    """
+    legs = compiled.item_legs
+    legs.sync(item_version)
+    out: Dict[Tuple, Tuple[float, List[Tuple[float, float]]]] = {}
+    todo: Dict = {}
+    for a, b in pairs:
+        if (a, b) in out:
+            continue
+        if a == b:
+            out[(a, b)] = (0.0, [pos[a]])
+            continue
+        cached = legs.get(a, b) if isinstance(a, int) and isinstance(b, int) else None
+        if cached is not None:
+            out[(a, b)] = cached
+        elif b not in todo.setdefault(a, []):
+            todo[a].append(b)
+    if not todo:
+        return out
+    keys = list(dict.fromkeys(list(todo) + [b for bs in todo.values() for b in bs]))
+    overlay = _QueryOverlay(compiled)
+    anchors = anchors or {}
+    snapped = [_anchor_on(compiled, anchors.get(k)) for k in keys]
+    nodes = overlay.attach([pos[k] for k in keys], snapped)
+    node_of = dict(zip(keys, nodes)) if nodes is not None else {}
+    for a, bs in todo.items():
+        if nodes is not None:
+            dist, prev = overlay.search_many(node_of[a], [node_of[b] for b in bs])
+        for b in bs:
+            pl = overlay.polyline(prev, node_of[a], node_of[b]) if nodes is not None else None
+            if pl is not None:
+                leg = (dist[node_of[b]], pl)
+            else:
+                # unreachable in the shared overlay: fall back to a standalone
+                # route, which also tries the nearest-node snap
+                pl = _shortest_polyline_between(pos[a], pos[b], compiled)
+                leg = (_polyline_length(pl), pl)
+            out[(a, b)] = leg
+            if isinstance(a, int) and isinstance(b, int):
+                legs.put(a, b, leg, item_version)
+                legs.put(b, a, (leg[0], leg[1][::-1]), item_version)
+    return out
+
+# floor of segments/items without a z
+_FLOOR0 = 0.0
+# item types that join floors; items of one type with the same name on different
+# floors are the same connector (e.g. "Elevator A" on floors 0-3)
+_CONNECTOR_TYPES = ("elevator", "escalator", "stairs")
+
+
+class _FloorPlan(NamedTuple):
+    """Floors that have segments in a mart, and the connector items joining them."""
+    # content_version the plan was read at; it also keys the graphs' item leg caches
+    item_version: int
+    floors: Tuple[float, ...]
+    # connector item id -> (floor, position, type, normalised name)
+    connectors: Dict[int, Tuple[float, Tuple[float, float], str, str]]
+
+    @property
+    def multi(self) -> bool:
+        return len(self.floors) > 1
+
+    def floor_of(self, z) -> Optional[float]:
+        """Floor key of a z value; None on single-floor marts, where z is ignored."""
+        if not self.multi:
+            return None
+        return _FLOOR0 if z is None else float(z)
+
+
+async def _get_floor_plan(db: AsyncSession, mart_id: Optional[int] = None) -> _FloorPlan:
+    _, item_version = await catalog_version.route_versions(db, mart_id)
+    return await graph_cache.get_or_build(
+        ("floors", mart_id), item_version, lambda: _load_floor_plan(db, mart_id, item_version))
+
+
+async def _load_floor_plan(db: AsyncSession, mart_id: Optional[int], item_version: int) -> _FloorPlan:
+    fstmt = select(Segment.z).distinct()
+    cstmt = select(Item).where(Item.type.in_(_CONNECTOR_TYPES))
+    if mart_id is not None:
+        fstmt = fstmt.where(_mart_scope(Segment.mart_id, mart_id))
+        cstmt = cstmt.where(Item.mart_id == mart_id)
+    fres = await db.execute(fstmt)
+    floors = tuple(sorted({_FLOOR0 if z is None else float(z) for (z,) in fres.all()}))
+    cres = await db.execute(cstmt)
+    connectors = {
+        it.id: (
+            _FLOOR0 if it.z is None else float(it.z),
+            (float(it.x), float(it.y)),
+            it.type,
+            (it.name or "").strip().lower(),
+        )
+        for it in cres.scalars().all()
+    }
+    return _FloorPlan(item_version, floors, connectors)
+
+
+def _append_leg(combined: List[Tuple[float, float]], leg: List[Tuple[float, float]]) -> None:
+    # avoid duplicate joint point
+    if combined and leg and combined[-1] == leg[0]:
+        combined.extend(leg[1:])
+    else:
+        combined.extend(leg)
+
+
+async def _floor_legs(db: AsyncSession, mart_id: Optional[int], plan: _FloorPlan, pos: Dict, floor_of: Dict, pairs: List[Tuple]) -> Dict[Tuple, Tuple[float, List[Tuple[float, float]], Optional[List]]]:
+    """
+    Walking (distance, polyline, parts) for every (a, b) pair of keys in `pos`.
+
+    On single-floor marts this is `_network_legs` on the mart graph and parts is
+    None. Otherwise `floor_of` gives each key's floor: pairs on one floor are
+    searched on that floor's own graph, and pairs across floors go through
+    connector items, combining per-floor legs to, between and from connectors
+    with transfer costs in a small search over the connectors. parts lists the
+    route per floor as [z, polyline, connector id taken to leave the floor].
+    """
+    if not plan.multi:
+        compiled = await _get_compiled_graph(db, mart_id)
+        anchors = await _load_anchors(db, pos)
+        legs = await route_pool.run_on_graph(compiled, _network_legs, pos, pairs, anchors, plan.item_version, pack=_shippable)
+        return {k: (d, pl, None) for k, (d, pl) in legs.items()}
+
+    pos = dict(pos)
+    floor_of = dict(floor_of)
+    cross = [(a, b) for a, b in pairs if floor_of[a] != floor_of[b]]
+    by_floor: Dict[float, List[Tuple]] = {}
+    for a, b in pairs:
+        if floor_of[a] == floor_of[b]:
+            by_floor.setdefault(floor_of[a], []).append((a, b))
+    conn_on: Dict[float, List[int]] = {}
+    groups: Dict[Tuple[str, str], List[int]] = {}
+    if cross:
+        for cid, (f, p, typ, name) in plan.connectors.items():
+            conn_on.setdefault(f, []).append(cid)
+            groups.setdefault((typ, name), []).append(cid)
+            pos[cid] = p
+            floor_of[cid] = f
+        for f, cs in conn_on.items():
+            by_floor.setdefault(f, []).extend((c, e) for c in cs for e in cs if c != e)
+        for a, b in cross:
+            by_floor.setdefault(floor_of[a], []).extend((a, c) for c in conn_on.get(floor_of[a], ()))
+            by_floor.setdefault(floor_of[b], []).extend((c, b) for c in conn_on.get(floor_of[b], ()))
+    walk: Dict[Tuple, Tuple[float, List[Tuple[float, float]]]] = {}
+    anchors = await _load_anchors(db, pos)
+    for f, fpairs in by_floor.items():
+        compiled = await _get_compiled_graph(db, mart_id, f)
+        walk.update(await route_pool.run_on_graph(compiled, _network_legs, pos, fpairs, anchors, plan.item_version, pack=_shippable))
+
+    out: Dict[Tuple, Tuple[float, List[Tuple[float, float]], Optional[List]]] = {}
+    for a, b in pairs:
+        if floor_of[a] == floor_of[b]:
+            d, pl = walk[(a, b)]
+            out[(a, b)] = (d, pl, [[floor_of[a], pl, None]])
+
+    transfer = settings.ROUTE_FLOOR_TRANSFER_COST
+    for a in dict.fromkeys(a for a, _ in cross):
+        # Dijkstra over connectors, seeded with the walks from a on its floor
+        dist = {c: walk[(a, c)][0] for c in conn_on.get(floor_of[a], ())}
+        prev: Dict[int, Optional[int]] = {c: None for c in dist}
+        pq = [(d, c) for c, d in dist.items()]
+        heapq.heapify(pq)
+        while pq:
+            d, c = heapq.heappop(pq)
+            if d > dist[c]:
+                continue
+            f, _, typ, name = plan.connectors[c]
+            steps = [(e, walk[(c, e)][0]) for e in conn_on[f] if e != c]
+            per_floor = float(transfer.get(typ, max(transfer.values(), default=0.0)))
+            steps += [(e, per_floor * abs(plan.connectors[e][0] - f))
+                      for e in groups[(typ, name)] if plan.connectors[e][0] != f]
+            for e, w in steps:
+                nd = d + w
+                if nd < dist.get(e, float('inf')):
+                    dist[e] = nd
+                    prev[e] = c
+                    heapq.heappush(pq, (nd, e))
+        for b in [b for x, b in cross if x == a]:
+            fa, fb = floor_of[a], floor_of[b]
+            ends = [(dist[c] + walk[(c, b)][0], c) for c in conn_on.get(fb, ()) if c in dist]
+            if not ends:
+                # no connector joins the two floors: report a straight jump
+                out[(a, b)] = (_dist(pos[a], pos[b]), [pos[a], pos[b]], [[fa, [pos[a]], None], [fb, [pos[b]], None]])
+                continue
+            total, last = min(ends)
+            chain = [last]
+            while prev[chain[-1]] is not None:
+                chain.append(prev[chain[-1]])
+            chain.reverse()
+            parts = [[fa, list(walk[(a, chain[0])][1]), None]]
+            for c, e in zip(chain, chain[1:]):
+                if floor_of[c] == floor_of[e]:
+                    _append_leg(parts[-1][1], walk[(c, e)][1])
+                else:
+                    parts[-1][2] = c
+                    parts.append([floor_of[e], [pos[e]], None])
+            _append_leg(parts[-1][1], walk[(chain[-1], b)][1])
+            combined: List[Tuple[float, float]] = []
+            for part in parts:
+                _append_leg(combined, part[1])
+            out[(a, b)] = (total, combined, parts)
+    return out
+
+
+def _join_legs(legs: List[Tuple[float, List[Tuple[float, float]], Optional[List]]], combined: Optional[List[Tuple[float, float]]] = None):
+    """Concatenate legs into one polyline plus merged per-floor parts (None on single-floor marts)."""
+    combined = list(combined or [])
+    parts: List = []
+    for _, pl, lparts in legs:
+        _append_leg(combined, pl)
+        for f, ppl, via in lparts or ():
+            if parts and parts[-1][0] == f and parts[-1][2] is None:
+                _append_leg(parts[-1][1], ppl)
+                parts[-1][2] = via
+            else:
+                parts.append([f, list(ppl), via])
+    return combined, (parts or None)
+
+
+# output encodings of route polylines (see polyline_codec)
+_ENCODINGS = ("points", "polyline", "flat")
+
+
+def _check_output_opts(req) -> None:
+    if (req.encoding or "points").lower() not in _ENCODINGS:
+        raise HTTPException(status_code=400, detail=f"encoding must be one of {', '.join(_ENCODINGS)}")
+    if req.simplify is not None and req.simplify < 0:
+        raise HTTPException(status_code=400, detail="simplify must be >= 0")
+
+
+def _polyline_fields(pts: List[Tuple[float, float]], req) -> Dict:
+    """`polyline` (or its compact form) for a response, simplified/encoded as `req` asks."""
+    if req.simplify:
+        pts = polyline_codec.simplify(pts, req.simplify)
+    encoding = (req.encoding or "points").lower()
+    if encoding == "polyline":
+        return {"polyline": [], "polyline_encoded": polyline_codec.encode(pts, settings.ROUTE_POLYLINE_PRECISION)}
+    if encoding == "flat":
+        return {"polyline": [], "polyline_flat": polyline_codec.flatten(pts)}
+    return {"polyline": [RoutePoint(x=p[0], y=p[1]) for p in pts]}
+
+
+def _floor_parts(parts: Optional[List], req) -> Optional[List[RouteFloorPart]]:
+    if parts is None:
+        return None
+    return [RouteFloorPart(z=f, via_item_id=via, **_polyline_fields(pl, req)) for f, pl, via in parts]
+
+
+class _PathGraph:
+    """
+    Item-to-item graph from the `paths` table: an edge per path row (walkable in
+    both directions), weighted by its stored distance and drawn with the linked
+    segment's polyline, or a straight line when the path has no segment.
+    Shortest-path trees are kept per source item, so repeated routes from the
+    same item are answered without searching again.
+
+    `route` runs in the route pool: pool threads share the tree cache under
+    `lock`, and a copy pickled to a pool process starts with an empty one.
+    """
+    MAX_TREES = 256
+
+    def __init__(self):
+        self.adj: Dict[int, Dict[int, Tuple[float, List[Tuple[float, float]]]]] = {}
+        self.trees: Dict[int, Tuple[Dict[int, float], Dict[int, int]]] = {}
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        return {"adj": self.adj}
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.adj = state["adj"]
+
+    def add_edge(self, a: int, b: int, w: float, pl: List[Tuple[float, float]]) -> None:
+        if a == b:
+            return
+        if w < self.adj.get(a, {}).get(b, (float('inf'),))[0]:
+            self.adj.setdefault(a, {})[b] = (w, pl)
+            self.adj.setdefault(b, {})[a] = (w, pl[::-1])
+
+    def _tree(self, src: int) -> Tuple[Dict[int, float], Dict[int, int]]:
+        with self.lock:
+            tree = self.trees.get(src)
+        if tree is None:
+            dist: Dict[int, float] = {src: 0.0}
+            prev: Dict[int, int] = {}
+            pq = [(0.0, src)]
+            while pq:
+                d, u = heapq.heappop(pq)
+                if d > dist[u]:
+                    continue
+                for v, (w, _) in self.adj.get(u, {}).items():
+                    nd = d + w
+                    if nd < dist.get(v, float('inf')):
+                        dist[v] = nd; prev[v] = u
+                        heapq.heappush(pq, (nd, v))
+            tree = (dist, prev)
+            with self.lock:
+                if src not in self.trees and len(self.trees) >= self.MAX_TREES:
+                    self.trees.pop(next(iter(self.trees)), None)
+                self.trees[src] = tree
+        return tree
+
+    def route(self, src: int, dst: int) -> Optional[Tuple[List[int], List[Tuple[float, float]]]]:
+        """(item ids passed, polyline) from src to dst, or None if paths do not connect them."""
+        if src == dst or src not in self.adj:
+            return None
+        dist, prev = self._tree(src)
+        if dst not in dist:
+            return None
+        nodes = [dst]
+        while nodes[-1] != src:
+            nodes.append(prev[nodes[-1]])
+        nodes.reverse()
+        pts: List[Tuple[float, float]] = []
+        for a, b in zip(nodes, nodes[1:]):
+            leg = self.adj[a][b][1]
+            pts.extend(leg[1:] if pts and pts[-1] == leg[0] else leg)
+        return nodes, pts
+
+
+async def _get_path_graph(db: AsyncSession, mart_id: Optional[int] = None) -> _PathGraph:
+    """
+    Cached item graph from one mart's paths, keyed on the mart's content_version:
+    path, segment and item writes all advance it.
+    """
+    _, version = await catalog_version.route_versions(db, mart_id)
+    return await graph_cache.get_or_build(("paths", mart_id), version, lambda: _load_path_graph(db, mart_id))
+
+
+async def _load_path_graph(db: AsyncSession, mart_id: Optional[int]) -> _PathGraph:
+    pg = _PathGraph()
+    istmt = select(Item.id, Item.x, Item.y)
+    sstmt = select(Segment.from_item_id, Segment.to_item_id, *_SEGMENT_GEOMETRY).where(
+        Segment.from_item_id.is_not(None), Segment.to_item_id.is_not(None))
+    pstmt = select(Path)
+    if mart_id is not None:
+        istmt = istmt.where(Item.mart_id == mart_id)
+        sstmt = sstmt.where(_mart_scope(Segment.mart_id, mart_id))
+        pstmt = pstmt.where(_mart_scope(Path.mart_id, mart_id))
+    ires = await db.execute(istmt)
+    pos = {i: (float(x), float(y)) for i, x, y in ires.all()}
+    # geometry of item-linked segments, drawn in either direction
+    geom: Dict[Tuple[int, int], List[Tuple[float, float]]] = {}
+    sres = await db.execute(sstmt)
+    for a, b, blob, raw_json in sres.all():
+        try:
+            pl = _segment_points(blob, raw_json)
+        except Exception:
+            continue
+        if len(pl) < 2:
+            continue
+        if (a, b) not in geom or _polyline_length(pl) < _polyline_length(geom[(a, b)]):
+            geom[(a, b)] = pl
+            geom[(b, a)] = pl[::-1]
+    pres = await db.execute(pstmt)
+    for path in pres.scalars().all():
+        a, b = path.from_item_id, path.to_item_id
+        if a not in pos or b not in pos:
+            continue
+        pl = geom.get((a, b)) or [pos[a], pos[b]]
+        pg.add_edge(a, b, float(path.distance), pl)
+    return pg
 
 @router.post("/coords", response_model=RoutePolylineResponse)
 async def get_route_by_coords(req: RouteByCoordsRequest, db: AsyncSession = Depends(get_db)):
@@ -343,123 +1510,193 @@ async def get_route_by_coords(req: RouteByCoordsRequest, db: AsyncSession = Depe
     Чөлөөт координатаас маршрутын polyline-г бодож буцаана.
     Алгоритм: бүх segments-оос граф үүсгээд, эх/төгсгөлийг ойрын ирмэгт snap хийж Dijkstra-аар бодно.
     """
-    res = await db.execute(select(Segment))
-    seg_rows = res.scalars().all()
-    polylines: List[List[Tuple[float, float]]] = []
-    for r in seg_rows:
-        try:
-            pl = json.loads(r.polyline_json)
-            pts = [(float(p["x"]), float(p["y"])) for p in pl]
-            if len(pts) >= 2:
-                polylines.append(pts)
-        except Exception:
-            continue
-    if not polylines:
-        return RoutePolylineResponse(polyline=[
-            RoutePoint(x=req.start.x, y=req.start.y),
-            RoutePoint(x=req.end.x, y=req.end.y),
-        ])
-    graph, coords_by_key = _build_graph(polylines)
-    # Connect very-near nodes to bridge tiny gaps between drawn segments
-    # Allow slightly larger snapping tolerance to bridge small drawing gaps
-    _connect_nearby_nodes(graph, coords_by_key, eps=20.0)
-    algo = (req.algorithm or "").lower().strip() or "astar"
-    poly = _shortest_polyline_between((req.start.x, req.start.y), (req.end.x, req.end.y), graph, coords_by_key, polylines, algorithm=algo)
-    return RoutePolylineResponse(polyline=[RoutePoint(x=p[0], y=p[1]) for p in poly])
+    _check_output_opts(req)
+    plan = await _get_floor_plan(db, req.mart_id)
+    start, end = (req.start.x, req.start.y), (req.end.x, req.end.y)
+    fs, fe = plan.floor_of(req.start.z), plan.floor_of(req.end.z)
+    if fs != fe:
+        # different floors: joined through elevator/escalator/stairs items
+        legs = await _floor_legs(db, req.mart_id, plan, {_START: start, _END: end}, {_START: fs, _END: fe}, [(_START, _END)])
+        _, poly, parts = legs[(_START, _END)]
+        return RoutePolylineResponse(floors=_floor_parts(parts, req), **_polyline_fields(poly, req))
+    compiled = await _get_compiled_graph(db, req.mart_id, fs)
+    if not compiled.has_segments:
+        poly = [start, end]
+    else:
+        algo = (req.algorithm or "").lower().strip() or "astar"
+        poly = await route_pool.run_on_graph(compiled, _route_polyline, start, end, algo, pack=_shippable)
+    parts = [[fs, poly, None]] if fs is not None else None
+    return RoutePolylineResponse(floors=_floor_parts(parts, req), **_polyline_fields(poly, req))
+
+# upper bound on the number of routes one /batch request may ask for
+_BATCH_MAX_ROUTES = 2000
+
+
+@router.post("/batch", response_model=RouteBatchResponse)
+async def route_batch(req: RouteBatchRequest, db: AsyncSession = Depends(get_db)):
+    """
+    Олон маршрутыг нэг хүсэлтээр бодно: (start, end) хосууд болон нэг эхлэлээс олон
+    бараа/цэг рүү (one_to_many). Граф нэг удаа ачаалагдаж, давхардаагүй эх цэг бүрт
+    нэг л хайлт (one-to-many Dijkstra) хийгдэнэ.
+    """
+    _check_output_opts(req)
+    n_routes = len(req.pairs) + sum(len(q.item_ids) + len(q.ends) for q in req.one_to_many)
+    if n_routes > _BATCH_MAX_ROUTES:
+        raise HTTPException(status_code=400, detail=f"Too many routes (max {_BATCH_MAX_ROUTES})")
+    if n_routes == 0:
+        return RouteBatchResponse(routes=[])
+
+    item_ids = {i for q in req.one_to_many for i in q.item_ids}
+    items: Dict[int, Item] = {}
+    if item_ids:
+        ires = await db.execute(select(Item).where(Item.id.in_(item_ids)))
+        items = {it.id: it for it in ires.scalars().all()}
+        missing = sorted(item_ids - items.keys())
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Item {missing[0]} not found")
+
+    mart_id = req.mart_id
+    if mart_id is None and items:
+        mart_id = next(iter(items.values())).mart_id
+    plan = await _get_floor_plan(db, mart_id)
+
+    # free points are keyed by their coordinates and floor, items by id (so item
+    # legs can come from the graph's leg cache)
+    pos: Dict = {}
+    floor_of: Dict = {}
+    def point_key(p: RouteFloorPoint) -> Tuple:
+        key = (p.x, p.y, plan.floor_of(p.z))
+        pos[key] = (p.x, p.y)
+        floor_of[key] = key[2]
+        return key
+    for i, it in items.items():
+        pos[i] = (float(it.x), float(it.y))
+        floor_of[i] = plan.floor_of(it.z)
+
+    wanted: List[Tuple] = []
+    for pair in req.pairs:
+        wanted.append((point_key(pair.start), point_key(pair.end)))
+    for q in req.one_to_many:
+        src = point_key(q.start)
+        wanted.extend((src, i) for i in q.item_ids)
+        wanted.extend((src, point_key(e)) for e in q.ends)
+    legs = await _floor_legs(db, mart_id, plan, pos, floor_of, wanted)
+
+    routes: List[RouteBatchRoute] = []
+    for a, b in wanted:
+        distance, pl, parts = legs[(a, b)]
+        routes.append(RouteBatchRoute(
+            start=RoutePoint(x=pos[a][0], y=pos[a][1]),
+            end=RoutePoint(x=pos[b][0], y=pos[b][1]),
+            item_id=b if isinstance(b, int) else None,
+            distance=distance,
+            floors=_floor_parts(parts, req),
+            **_polyline_fields(pl, req),
+        ))
+    return RouteBatchResponse(routes=routes)
 
 @router.post("/plan", response_model=RoutePlanResponse)
 async def plan_multistop(req: RoutePlanRequest, db: AsyncSession = Depends(get_db)):
     """
-    Олон бараанд хамгийн ойролцоогоор (greedy) дараалсан маршрутын polyline + эрэмбэлсэн item id-уудыг буцаана.
+    Олон барааг хамгийн богино нийт алхах замаар дараалуулж, polyline + эрэмбэлсэн item id-уудыг буцаана.
     Эхлэх цэг: req.start (заавал биш). Байхгүй бол эхний item-оос эхэлнэ.
+    Төгсгөл: req.end_item_id (ж: касс) эсвэл req.end цэг (заавал биш) — заасан бол маршрут тэнд дуусна.
+    Зай нь шулуун биш, алхах замын (network) зайгаар тооцогдоно. Цөөн барааг яг (bitmask DP),
+    олон барааг 2-opt/Or-opt-оор сайжруулж эрэмбэлнэ.
     """
-    # Load segments graph once
-    res = await db.execute(select(Segment))
-    seg_rows = res.scalars().all()
-    polylines: List[List[Tuple[float, float]]] = []
-    for r in seg_rows:
-        try:
-            pl = json.loads(r.polyline_json)
-            pts = [(float(p["x"]), float(p["y"])) for p in pl]
-            if len(pts) >= 2:
-                polylines.append(pts)
-        except Exception:
-            continue
-    graph, coords_by_key = _build_graph(polylines)
-
+    _check_output_opts(req)
     # Load items
-    ires = await db.execute(select(Item))
+    wanted_ids = set(req.item_ids)
+    if req.end_item_id is not None:
+        wanted_ids.add(req.end_item_id)
+    ires = await db.execute(select(Item).where(Item.id.in_(wanted_ids)))
     all_items = {it.id: it for it in ires.scalars().all()}
-    targets = [all_items[i] for i in req.item_ids if i in all_items]
-    if not targets:
-        return RoutePlanResponse(ordered_ids=[], polyline=[])
-
+    targets = [all_items[i] for i in dict.fromkeys(req.item_ids) if i in all_items]
+    end_item = None
+    if req.end_item_id is not None:
+        end_item = all_items.get(req.end_item_id)
+        if end_item is None:
+            raise HTTPException(status_code=404, detail="Item not found")
+        targets = [it for it in targets if it.id != end_item.id]
+    if not targets and end_item is None:
+        return RoutePlanResponse(ordered_ids=[], polyline=[], total_distance=0.0)
+
+    # Floors of the items' mart (unless one is given); graphs load per floor
+    mart_id = req.mart_id if req.mart_id is not None else (targets[0] if targets else end_item).mart_id
+    plan = await _get_floor_plan(db, mart_id)
+
+    pos: Dict = {it.id: (float(it.x), float(it.y)) for it in targets}
+    floor_of: Dict = {it.id: plan.floor_of(it.z) for it in targets}
+    stops: List = [it.id for it in targets]
     # Determine start point
     if req.start is not None:
-        cur = (req.start.x, req.start.y)
-    else:
+        start_key = _START
+        pos[_START] = (req.start.x, req.start.y)
+        floor_of[_START] = plan.floor_of(req.start.z)
+        stops.insert(0, _START)
+    elif targets:
         # default to first item position
-        first = targets[0]
-        cur = (float(first.x), float(first.y))
-
-    remaining = targets[:]
-    order: List[Item] = []
-    # Greedy nearest neighbor over Euclidean as heuristic
-    while remaining:
-        nearest = min(remaining, key=lambda it: _dist(cur, (float(it.x), float(it.y))))
-        order.append(nearest)
-        cur = (float(nearest.x), float(nearest.y))
-        remaining.remove(nearest)
-
-    # Build combined polyline
-    combined: List[Tuple[float,float]] = []
-    cur_pt = (req.start.x, req.start.y) if req.start is not None else (float(order[0].x), float(order[0].y))
-    for idx, it in enumerate(order):
-        goal = (float(it.x), float(it.y))
-        if idx == 0 and req.start is None:
-            # already at first item; just append
-            if not combined:
-                combined.append(goal)
-            continue
-        leg = _shortest_polyline_between(cur_pt, goal, graph, coords_by_key, polylines)
-        if not combined:
-            combined.extend(leg)
-        else:
-            # avoid duplicate joint point
-            if combined[-1] == leg[0]:
-                combined.extend(leg[1:])
-            else:
-                combined.extend(leg)
-        cur_pt = goal
+        start_key = stops[0]
+    else:
+        # only the end item was given: the route is just that point
+        start_key = end_item.id
+        pos[start_key] = (float(end_item.x), float(end_item.y))
+        floor_of[start_key] = plan.floor_of(end_item.z)
+        stops.append(start_key)
+    # Optional fixed end: a checkout-like item, or a free point
+    end_key = None
+    if end_item is not None:
+        end_key = end_item.id
+        if end_key != start_key:
+            pos[end_key] = (float(end_item.x), float(end_item.y))
+            floor_of[end_key] = plan.floor_of(end_item.z)
+            stops.append(end_key)
+    elif req.end is not None:
+        end_key = _END
+        pos[_END] = (req.end.x, req.end.y)
+        floor_of[_END] = plan.floor_of(req.end.z)
+        stops.append(_END)
+    if end_key == start_key:
+        end_key = None
+
+    # Walking distances between every pair of stops (nothing leads back into the
+    # start or out of the end), one search per source
+    pairs = [(a, b) for a in stops for b in stops
+             if a != b and b != start_key and a != end_key]
+    legs = await _floor_legs(db, mart_id, plan, pos, floor_of, pairs)
+    inf = float("inf")
+    dist = [[0.0 if a == b else legs[(a, b)][0] if (a, b) in legs else inf for b in stops] for a in stops]
+    budget = max(settings.ROUTE_PLAN_TIME_BUDGET_MS, 0) / 1000.0
+    idx, total = await route_pool.run(
+        solve_path,
+        dist,
+        stops.index(start_key),
+        stops.index(end_key) if end_key is not None else None,
+        budget,
+    )
+    route = [stops[i] for i in idx]
+    order = [k for k in route if isinstance(k, int)]
+
+    # Build combined polyline (and per-floor parts on multi-floor marts)
+    combined, parts = _join_legs(
+        [legs[(a, b)] for a, b in zip(route, route[1:])],
+        [pos[route[0]]] if route[0] != _START else [],
+    )
 
     return RoutePlanResponse(
-        ordered_ids=[it.id for it in order],
-        polyline=[RoutePoint(x=p[0], y=p[1]) for p in combined]
+        ordered_ids=order,
+        total_distance=total,
+        floors=_floor_parts(parts, req),
+        **_polyline_fields(combined, req),
     )
 
 @router.post("/list", response_model=RouteListResponse)
 async def route_from_list(req: RouteListRequest, db: AsyncSession = Depends(get_db)):
+    _check_output_opts(req)
     if not req.item_ids:
         return RouteListResponse(ordered_ids=[], polyline=[])
 
-    res = await db.execute(select(Segment))
-    seg_rows = res.scalars().all()
-    polylines: List[List[Tuple[float, float]]] = []
-    for r in seg_rows:
-        try:
-            pl = json.loads(r.polyline_json)
-            pts = [(float(p["x"]), float(p["y"])) for p in pl]
-            if len(pts) >= 2:
-                polylines.append(pts)
-        except Exception:
-            continue
-    if not polylines:
-        raise HTTPException(status_code=500, detail="Route graph unavailable")
-
-    graph, coords_by_key = _build_graph(polylines)
-    _connect_nearby_nodes(graph, coords_by_key, eps=20.0)
-
-    ires = await db.execute(select(Item))
+    ires = await db.execute(select(Item).where(Item.id.in_(set(req.item_ids))))
     items_map = {it.id: it for it in ires.scalars().all()}
     ordered_items: List[Item] = []
     for item_id in req.item_ids:
@@ -468,27 +1705,24 @@ async def route_from_list(req: RouteListRequest, db: AsyncSession = Depends(get_
             raise HTTPException(status_code=404, detail=f"Item {item_id} not found")
         ordered_items.append(it)
 
-    current = (req.user.x, req.user.y)
-    combined: List[Tuple[float, float]] = []
-    for idx, it in enumerate(ordered_items):
-        dest = (float(it.x), float(it.y))
-        leg = _shortest_polyline_between(current, dest, graph, coords_by_key, polylines)
-        if not leg:
-            current = dest
-            continue
-        if not combined:
-            combined.extend(leg)
-        else:
-            if combined[-1] == leg[0]:
-                combined.extend(leg[1:])
-            else:
-                combined.extend(leg)
-        current = dest
+    mart_id = req.mart_id if req.mart_id is not None else ordered_items[0].mart_id
+    plan = await _get_floor_plan(db, mart_id)
+    if not plan.floors:
+        raise HTTPException(status_code=500, detail="Route graph unavailable")
+
+    pos: Dict = {it.id: (float(it.x), float(it.y)) for it in ordered_items}
+    floor_of: Dict = {it.id: plan.floor_of(it.z) for it in ordered_items}
+    pos[_START] = (req.user.x, req.user.y)
+    floor_of[_START] = plan.floor_of(req.user.z)
+    stops = [_START] + [it.id for it in ordered_items]
+    legs = await _floor_legs(db, mart_id, plan, pos, floor_of, list(zip(stops, stops[1:])))
+
+    combined, parts = _join_legs([legs[(a, b)] for a, b in zip(stops, stops[1:])])
 
     if not combined:
         return RouteListResponse(
             ordered_ids=[it.id for it in ordered_items],
-            polyline=[RoutePoint(x=req.user.x, y=req.user.y)],
+            **_polyline_fields([(req.user.x, req.user.y)], req),
         )
 
     cleaned: List[Tuple[float, float]] = []
@@ -498,7 +1732,8 @@ async def route_from_list(req: RouteListRequest, db: AsyncSession = Depends(get_
 
     return RouteListResponse(
         ordered_ids=[it.id for it in ordered_items],
-        polyline=[RoutePoint(x=p[0], y=p[1]) for p in cleaned],
+        floors=_floor_parts(parts, req),
+        **_polyline_fields(cleaned, req),
     )
     def qkey(x: float, y: float, prec: int = 4) -> str:
         return f"{round(x, prec):.{prec}f},{round(y, prec):.{prec}f}"
@@ -1,36 +1,73 @@
 # routers/segments.py
-from fastapi import APIRouter, Depends, HTTPException, Response
+from fastapi import APIRouter, Depends, HTTPException, Response, Query
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, or_
 from typing import List
 import math, json
 
 from database import get_db
 from models import Segment, Path, Item
 from schemas import SegmentCreate, SegmentFreeCreate, SegmentRead
+import polyline_codec
+import anchor_refresh
+from listing import Page, columns_for, projected
+import catalog_version
 
 router = APIRouter(prefix="/api/segments", tags=["segments"])
 
-@router.get("", response_model=List[SegmentRead])
-async def list_segments(db: AsyncSession = Depends(get_db)):
+def _polyline_points(blob, raw) -> list:
+    packed = polyline_codec.from_blob(blob)
+    if packed is not None:
+        return [{"x": x, "y": y} for x, y in packed.tolist()]
+    try:
+        return json.loads(raw)
+    except Exception:
+        return []
+
+
+def segment_read(r: Segment) -> dict:
+    return {
+        "id": r.id,
+        "mart_id": r.mart_id,
+        "z": float(r.z) if r.z is not None else None,
+        "from_item_id": r.from_item_id,
+        "to_item_id": r.to_item_id,
+        "polyline": _polyline_points(r.polyline_blob, r.polyline_json)
+    }
+
+
+# response fields built from other columns
+_DERIVED = {"polyline": ("polyline_blob", "polyline_json")}
+
+
+@router.get("", response_model=List[SegmentRead], dependencies=[Depends(catalog_version.conditional("segments"))])
+async def list_segments(
+    response: Response,
+    mart_id: int | None = Query(default=None),
+    page: Page = Depends(),
+    db: AsyncSession = Depends(get_db),
+):
     """
-    Бүх segment жагсаалтыг polyline-г JSON-оос хөрвүүлж буцаана.
+    Бүх segment жагсаалтыг polyline-г blob-оос (байхгүй бол JSON-оос) хөрвүүлж буцаана.
+    mart_id өгвөл тухайн mart-ын (болон mart-гүй хуучин) segment-үүдийг л буцаана.
+    after_id/limit-ээр хуудаслана, fields=...-ээр зөвхөн хэрэгтэй баганыг уншина.
     """
-    result = await db.execute(select(Segment))
-    rows = result.scalars().all()
-    out: List[SegmentRead] = []
-    for r in rows:
-        try:
-            pl = json.loads(r.polyline_json)
-        except Exception:
-            pl = []
-        out.append({
-            "id": r.id,
-            "from_item_id": r.from_item_id,
-            "to_item_id": r.to_item_id,
-            "polyline": pl
-        })
-    return out
+    wanted = page.wanted(SegmentRead)
+    stmt = select(Segment) if wanted is None else select(*columns_for(Segment, wanted, _DERIVED))
+    if mart_id is not None:
+        stmt = stmt.where(or_(Segment.mart_id == mart_id, Segment.mart_id.is_(None)))
+    result = await db.execute(page.apply(stmt, Segment.id))
+    rows = result.scalars().all() if wanted is None else result.all()
+    page.mark_next(response, [r.id for r in rows])
+    if wanted is not None:
+        out_rows = []
+        for row in rows:
+            data = dict(row._mapping)
+            if "polyline" in wanted:
+                data["polyline"] = _polyline_points(row.polyline_blob, row.polyline_json)
+            out_rows.append(data)
+        return projected(SegmentRead, wanted, out_rows, response)
+    return [segment_read(r) for r in rows]
 
 
 @router.post("", response_model=SegmentRead)
@@ -56,10 +93,15 @@ async def create_segment(seg: SegmentCreate, db: AsyncSession = Depends(get_db))
         raise HTTPException(status_code=404, detail="From/To item not found")
 
     # 4. Segment-г үүсгэх
+    mart_id = seg.mart_id if seg.mart_id is not None else from_item.mart_id
+    z = seg.z if seg.z is not None else (float(from_item.z) if from_item.z is not None else None)
     new_seg = Segment(
+        mart_id=mart_id,
+        z=z,
         from_item_id=seg.from_item_id,
         to_item_id=seg.to_item_id,
         polyline_json=polyline_json_str,
+        polyline_blob=polyline_codec.to_blob([(p.x, p.y) for p in seg.polyline]) if seg.polyline else None,
         walkable=1
     )
     db.add(new_seg)
@@ -67,18 +109,25 @@ async def create_segment(seg: SegmentCreate, db: AsyncSession = Depends(get_db))
 
     # 5. Path-г автоматаар үүсгэх
     new_path = Path(
+        mart_id=mart_id,
         from_item_id=seg.from_item_id,
         to_item_id=seg.to_item_id,
         distance=total_dist
     )
     db.add(new_path)
+    # mart_id None = shared segment, visible to every mart
+    new_seg.content_version = await catalog_version.bump(db, mart_id, routing=True)
 
     await db.commit()
     await db.refresh(new_seg)
+    # a new aisle may be closer to some items than the one they were snapped to
+    anchor_refresh.schedule(mart_id=new_seg.mart_id)
 
     # 6. Буцаахдаа polyline-г JSON string биш list хэлбэртэй болгоно
     return {
         "id": new_seg.id,
+        "mart_id": new_seg.mart_id,
+        "z": z,
         "from_item_id": new_seg.from_item_id,
         "to_item_id": new_seg.to_item_id,
         "polyline": seg.polyline
@@ -96,19 +145,27 @@ async def create_free_segment(seg: SegmentFreeCreate, db: AsyncSession = Depends
     polyline_json_str = json.dumps([{"x": p.x, "y": p.y} for p in seg.polyline])
 
     new_seg = Segment(
+        mart_id=seg.mart_id,
+        z=seg.z,
         from_item_id=None,
         to_item_id=None,
         polyline_json=polyline_json_str,
+        polyline_blob=polyline_codec.to_blob([(p.x, p.y) for p in seg.polyline]) if seg.polyline else None,
         walkable=1
     )
     db.add(new_seg)
 
     # distance-г одоогоор paths хүснэгтэд оруулахгүй (free-draw mode)
+    new_seg.content_version = await catalog_version.bump(db, seg.mart_id, routing=True)
     await db.commit()
     await db.refresh(new_seg)
+    # a new aisle may be closer to some items than the one they were snapped to
+    anchor_refresh.schedule(mart_id=new_seg.mart_id)
 
     return {
         "id": new_seg.id,
+        "mart_id": new_seg.mart_id,
+        "z": seg.z,
         "from_item_id": new_seg.from_item_id,
         "to_item_id": new_seg.to_item_id,
         "polyline": seg.polyline
@@ -120,6 +177,11 @@ async def delete_segment(segment_id: int, db: AsyncSession = Depends(get_db)):
     seg = await db.get(Segment, segment_id)
     if not seg:
         raise HTTPException(status_code=404, detail="Segment not found")
+    mart_id = seg.mart_id
+    version = await catalog_version.bump(db, mart_id, routing=True)
+    catalog_version.bury(db, "segment", segment_id, mart_id, version)
     await db.delete(seg)
     await db.commit()
+    # items anchored on it are snapped per request until then
+    anchor_refresh.schedule(mart_id=mart_id)
     return Response(status_code=204)
@@ -0,0 +1,128 @@
+"""
+Sale expiry.
+
+Items carry `sale_percent` until `sale_end_at`. Clearing expired sales is a
+write, so it does not happen on catalog reads: read paths use
+`effective_sale_percent` (their ETags also count the ended sales still stored,
+see `lapsed_sales`, so a client never revalidates a list past a sale's end),
+and an in-process task (`start`, every
+SALE_EXPIRY_INTERVAL_SEC) clears them in the database with one bulk UPDATE on
+the indexed `sale_end_at` column, bumping the content version (ETag) of the
+marts it touched. Every uvicorn worker runs its own task; the UPDATE is
+idempotent, so that is harmless.
+
+`sale_end_at` is a naive TIMESTAMP read as UTC (SQLite keeps no zone).
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import catalog_version
+from config import settings
+from database import async_session_factory
+from models import Item
+
+log = logging.getLogger(__name__)
+
+_task: Optional[asyncio.Task] = None
+
+
+def utcnow() -> datetime:
+    """Current UTC time as a naive datetime, comparable with stored sale_end_at."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _as_utc_naive(end) -> Optional[datetime]:
+    if isinstance(end, str):
+        try:
+            end = datetime.fromisoformat(end)
+        except ValueError:
+            return None
+    if not isinstance(end, datetime):
+        return None
+    if end.tzinfo is not None and end.tzinfo.utcoffset(end) is not None:
+        end = end.astimezone(timezone.utc).replace(tzinfo=None)
+    return end
+
+
+def is_expired(sale_end_at, now: Optional[datetime] = None) -> bool:
+    end = _as_utc_naive(sale_end_at)
+    return end is not None and (now or utcnow()) > end
+
+
+def effective_sale_percent(item, now: Optional[datetime] = None) -> Optional[int]:
+    """The item's sale_percent, or None once its sale has ended (whether or not the DB was updated yet)."""
+    if item.sale_percent is None or is_expired(item.sale_end_at, now):
+        return None
+    return item.sale_percent
+
+
+async def lapsed_sales(db: AsyncSession, mart_id: Optional[int] = None) -> int:
+    """
+    Number of items (of a mart) whose sale has ended but is still stored. For a
+    given content version it only grows with time, which makes it the ETag part
+    of reads that hide ended sales (`catalog_version.conditional(..., extra=)`).
+    """
+    stmt = select(func.count()).select_from(Item).where(Item.sale_end_at < utcnow(), Item.sale_percent.is_not(None))
+    if mart_id is not None:
+        stmt = stmt.where(Item.mart_id == mart_id)
+    return (await db.execute(stmt)).scalar_one()
+
+
+async def expire_sales() -> int:
+    """Clear sale_percent on every item whose sale has ended; returns the number of rows changed."""
+    expired = (Item.sale_end_at < utcnow(), Item.sale_percent.is_not(None))
+    async with async_session_factory() as session:
+        marts = (await session.execute(select(Item.mart_id).where(*expired).distinct())).scalars().all()
+        if not marts:
+            return 0
+        # cached item lists of those marts still carry the sale
+        version = await catalog_version.bump(session, marts)
+        res = await session.execute(
+            update(Item)
+            .where(*expired)
+            .values(sale_percent=None, content_version=version)
+            .execution_options(synchronize_session=False)
+        )
+        await session.commit()
+        return res.rowcount or 0
+
+
+async def _run(interval: float) -> None:
+    while True:
+        try:
+            n = await expire_sales()
+            if n:
+                log.info("expired sales on %d items", n)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log.exception("sale expiry failed")
+        await asyncio.sleep(interval)
+
+
+def start() -> None:
+    """Start the periodic expiry task (no-op if disabled or already running)."""
+    global _task
+    interval = settings.SALE_EXPIRY_INTERVAL_SEC
+    if interval <= 0 or (_task is not None and not _task.done()):
+        return
+    _task = asyncio.get_running_loop().create_task(_run(float(interval)))
+
+
+async def stop() -> None:
+    global _task
+    if _task is None:
+        return
+    _task.cancel()
+    try:
+        await _task
+    except asyncio.CancelledError:
+        pass
+    _task = None
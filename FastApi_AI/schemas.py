@@ -52,6 +52,8 @@ class PathBase(BaseModel):
     from_item_id: int
     to_item_id: int
     distance: float
+    # defaults to the mart of from_item
+    mart_id: Optional[int] = None
 
 class PathCreate(PathBase):
     pass
@@ -67,14 +69,38 @@ class PathRead(PathBase):
 class RouteRequest(BaseModel):
     from_item_id: int
     to_item_id: int
+    # defaults to the mart of from_item
+    mart_id: Optional[int] = None
+    # optional output shaping: Douglas-Peucker tolerance (map units) and
+    # encoding 'points' (default) | 'polyline' (encoded polyline) | 'flat' ([x0, y0, x1, ...])
+    simplify: Optional[float] = None
+    encoding: Optional[str] = None
 
 class RoutePoint(BaseModel):
     x: float
     y: float
 
+class RouteFloorPoint(RoutePoint):
+    # floor (same scale as items.z); omitted = floor 0
+    z: Optional[float] = None
+
+class RouteFloorPart(BaseModel):
+    # one floor's stretch of a multi-floor route
+    z: float
+    polyline: List[RoutePoint]
+    # connector item (elevator/escalator/stairs) taken to leave this floor
+    via_item_id: Optional[int] = None
+    # compact forms, filled instead of `polyline` when the request asks for an encoding
+    polyline_encoded: Optional[str] = None
+    polyline_flat: Optional[List[float]] = None
+
 class RouteResponse(BaseModel):
     polyline: List[RoutePoint]
     nodes: List[int]  # дамжсан item-үүдийн id жагсаалт
+    polyline_encoded: Optional[str] = None
+    polyline_flat: Optional[List[float]] = None
+    # per-floor parts of the polyline; only set for multi-floor marts
+    floors: Optional[List[RouteFloorPart]] = None
 
 
 
@@ -88,12 +114,20 @@ class SegmentCreate(BaseModel):
     from_item_id: int
     to_item_id: int
     polyline: List[Point]
+    # defaults to the mart of from_item
+    mart_id: Optional[int] = None
+    # floor; defaults to the floor of from_item
+    z: Optional[float] = None
 
 class SegmentFreeCreate(BaseModel):
     polyline: List[Point]
+    mart_id: Optional[int] = None
+    z: Optional[float] = None
 
 class SegmentRead(BaseModel):
     id: int
+    mart_id: Optional[int] = None
+    z: Optional[float] = None
     from_item_id: Optional[int] = None
     to_item_id: Optional[int] = None
     polyline: List[Point]
@@ -104,13 +138,20 @@ class SegmentRead(BaseModel):
 # Route by coordinates (free start/end)
 #
 class RouteByCoordsRequest(BaseModel):
-    start: Point
-    end: Point
+    start: RouteFloorPoint
+    end: RouteFloorPoint
     # optional: choose shortest-path algorithm: 'dijkstra' | 'astar'
     algorithm: Optional[str] = None
+    # optional: mart whose routing settings (snap tolerance) apply
+    mart_id: Optional[int] = None
+    simplify: Optional[float] = None
+    encoding: Optional[str] = None
 
 class RoutePolylineResponse(BaseModel):
     polyline: List[RoutePoint]
+    polyline_encoded: Optional[str] = None
+    polyline_flat: Optional[List[float]] = None
+    floors: Optional[List[RouteFloorPart]] = None
 
 
 #
@@ -135,20 +176,68 @@ class ChatbotResponse(BaseModel):
 # Multi-stop plan
 #
 class RoutePlanRequest(BaseModel):
-    start: Optional[RoutePoint] = None
+    start: Optional[RouteFloorPoint] = None
     item_ids: List[int]
+    mart_id: Optional[int] = None
+    # optional fixed end of the route: an item (e.g. checkout) or a free point
+    end_item_id: Optional[int] = None
+    end: Optional[RouteFloorPoint] = None
+    simplify: Optional[float] = None
+    encoding: Optional[str] = None
 
 class RoutePlanResponse(BaseModel):
     ordered_ids: List[int]
     polyline: List[RoutePoint]
+    polyline_encoded: Optional[str] = None
+    polyline_flat: Optional[List[float]] = None
+    # walking distance of the whole route (map units)
+    total_distance: Optional[float] = None
+    floors: Optional[List[RouteFloorPart]] = None
+
+class RouteBatchPair(BaseModel):
+    start: RouteFloorPoint
+    end: RouteFloorPoint
+
+class RouteBatchOneToMany(BaseModel):
+    start: RouteFloorPoint
+    # destinations: items (by id) and/or free points
+    item_ids: List[int] = []
+    ends: List[RouteFloorPoint] = []
+
+class RouteBatchRequest(BaseModel):
+    pairs: List[RouteBatchPair] = []
+    one_to_many: List[RouteBatchOneToMany] = []
+    mart_id: Optional[int] = None
+    simplify: Optional[float] = None
+    encoding: Optional[str] = None
+
+class RouteBatchRoute(BaseModel):
+    start: RoutePoint
+    end: RoutePoint
+    item_id: Optional[int] = None
+    distance: float
+    polyline: List[RoutePoint]
+    polyline_encoded: Optional[str] = None
+    polyline_flat: Optional[List[float]] = None
+    floors: Optional[List[RouteFloorPart]] = None
+
+class RouteBatchResponse(BaseModel):
+    # pairs first, then every one_to_many destination, in request order
+    routes: List[RouteBatchRoute]
 
 class RouteListRequest(BaseModel):
-    user: RoutePoint
+    user: RouteFloorPoint
     item_ids: List[int]
+    mart_id: Optional[int] = None
+    simplify: Optional[float] = None
+    encoding: Optional[str] = None
 
 class RouteListResponse(BaseModel):
     ordered_ids: List[int]
     polyline: List[RoutePoint]
+    polyline_encoded: Optional[str] = None
+    polyline_flat: Optional[List[float]] = None
+    floors: Optional[List[RouteFloorPart]] = None
 #
 # SLAM START (separate minimal schema)
 #
@@ -187,12 +276,16 @@ class MartBase(BaseModel):
     map_width_px: Optional[int] = None
     map_height_px: Optional[int] = None
     map_image_url: Optional[str] = None
+    # near-node bridging tolerance for routing (map px); None = server default
+    route_snap_eps: Optional[float] = None
 
 class MartCreate(MartBase):
     pass
 
 class MartRead(MartBase):
     id: int
+    # catalog хувилбар (ETag болон delta sync-д)
+    content_version: int = 0
     class Config:
         from_attributes = True
 
@@ -235,3 +328,24 @@ class CategoryRead(BaseModel):
     color: Optional[str] = None
     class Config:
         from_attributes = True
+
+#
+# MART CHANGES (delta sync)
+#
+class CatalogDeleted(BaseModel):
+    # ids removed from the mart (deleted or moved to another mart)
+    items: List[int] = []
+    categories: List[int] = []
+    segments: List[int] = []
+
+class MartChanges(BaseModel):
+    mart_id: int
+    since: int
+    # pass as `since` next time
+    version: int
+    # true: not a delta, replace the cached catalog with these rows
+    full: bool = False
+    items: List[ItemRead] = []
+    categories: List[CategoryRead] = []
+    segments: List[SegmentRead] = []
+    deleted: CatalogDeleted = CatalogDeleted()
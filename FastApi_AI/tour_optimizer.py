@@ -0,0 +1,147 @@
+"""
+Stop ordering for multi-stop routes.
+
+`solve_path` orders the stops of an open walking path that begins at a fixed
+node and optionally finishes at a fixed node (e.g. a checkout), minimising the
+total distance taken from a precomputed distance matrix. Small instances are
+solved exactly with a bitmask (Held-Karp) DP; larger ones start from a
+nearest-neighbour path and are improved with 2-opt and Or-opt moves until no
+move helps or the time budget runs out.
+"""
+from __future__ import annotations
+
+import time
+from typing import List, Optional, Sequence, Tuple
+
+# Held-Karp is O(2^n * n^2); beyond this many free stops use local search
+EXACT_MAX_STOPS = 10
+
+INF = float("inf")
+
+
+def path_cost(dist: Sequence[Sequence[float]], order: Sequence[int]) -> float:
+    return sum(dist[order[i]][order[i + 1]] for i in range(len(order) - 1))
+
+
+def solve_path(
+    dist: Sequence[Sequence[float]],
+    start: int,
+    end: Optional[int] = None,
+    time_budget: float = 0.2,
+) -> Tuple[List[int], float]:
+    """
+    Visit every node of `dist` once, starting at `start` (and ending at `end` when
+    given). Returns (order, total distance). The matrix is expected to be
+    (near-)symmetric, which the 2-opt reversal move relies on.
+    """
+    free = [i for i in range(len(dist)) if i != start and i != end]
+    deadline = time.perf_counter() + max(time_budget, 0.0)
+    if len(free) <= EXACT_MAX_STOPS:
+        middle = _held_karp(dist, start, end, free)
+    else:
+        middle = _nearest_neighbour(dist, start, free)
+        middle = _local_search(dist, start, end, middle, deadline)
+    order = [start] + middle + ([end] if end is not None else [])
+    return order, path_cost(dist, order)
+
+
+def _held_karp(dist, start: int, end: Optional[int], free: List[int]) -> List[int]:
+    m = len(free)
+    if m == 0:
+        return []
+    full = (1 << m) - 1
+    # cost[mask][j]: best start -> ... -> free[j] visiting exactly `mask` (j in mask)
+    cost = [[INF] * m for _ in range(1 << m)]
+    parent = [[-1] * m for _ in range(1 << m)]
+    for j in range(m):
+        cost[1 << j][j] = dist[start][free[j]]
+    for mask in range(1, full + 1):
+        row = cost[mask]
+        for j in range(m):
+            base = row[j]
+            if base == INF or not (mask >> j) & 1:
+                continue
+            dj = dist[free[j]]
+            for k in range(m):
+                if (mask >> k) & 1:
+                    continue
+                nmask = mask | (1 << k)
+                c = base + dj[free[k]]
+                if c < cost[nmask][k]:
+                    cost[nmask][k] = c
+                    parent[nmask][k] = j
+    best_j, best = 0, INF
+    for j in range(m):
+        c = cost[full][j] + (dist[free[j]][end] if end is not None else 0.0)
+        if c < best:
+            best_j, best = j, c
+    middle: List[int] = []
+    mask, j = full, best_j
+    while j >= 0:
+        middle.append(free[j])
+        mask, j = mask & ~(1 << j), parent[mask][j]
+    middle.reverse()
+    return middle
+
+
+def _nearest_neighbour(dist, start: int, free: List[int]) -> List[int]:
+    remaining = list(free)
+    out: List[int] = []
+    cur = start
+    while remaining:
+        nxt = min(remaining, key=lambda i: dist[cur][i])
+        out.append(nxt)
+        remaining.remove(nxt)
+        cur = nxt
+    return out
+
+
+def _local_search(dist, start: int, end: Optional[int], middle: List[int], deadline: float) -> List[int]:
+    path = [start] + middle + ([end] if end is not None else [])
+    n = len(path)
+    # positions 1..last may move; a fixed end stays at n-1
+    last = n - 2 if end is not None else n - 1
+
+    def link(a: int, b: int) -> float:
+        # cost of the edge from path[a] to path[b]; nothing follows an open end
+        return dist[path[a]][path[b]] if b < n else 0.0
+
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        # 2-opt: reverse path[i..j]
+        for i in range(1, last):
+            for j in range(i + 1, last + 1):
+                delta = (dist[path[i - 1]][path[j]] + (dist[path[i]][path[j + 1]] if j + 1 < n else 0.0)
+                         - link(i - 1, i) - link(j, j + 1))
+                if delta < -1e-9:
+                    path[i:j + 1] = path[i:j + 1][::-1]
+                    improved = True
+            if time.perf_counter() >= deadline:
+                break
+        # Or-opt: move a run of 1-3 stops elsewhere, optionally reversed
+        for k in (1, 2, 3):
+            i = 1
+            while i + k - 1 <= last and time.perf_counter() < deadline:
+                seg = path[i:i + k]
+                rest = path[:i] + path[i + k:]
+                removed = link(i - 1, i) + link(i + k - 1, i + k) - link(i - 1, i + k)
+                best_gain, best_at, best_rev = 1e-9, -1, False
+                rest_last = last - k
+                for j in range(0, rest_last + 1):
+                    a = rest[j]
+                    b = rest[j + 1] if j + 1 < len(rest) else None
+                    old = dist[a][b] if b is not None else 0.0
+                    for rev in (False, True):
+                        s0, s1 = (seg[-1], seg[0]) if rev else (seg[0], seg[-1])
+                        added = dist[a][s0] + (dist[s1][b] if b is not None else 0.0) - old
+                        gain = removed - added
+                        if gain > best_gain:
+                            best_gain, best_at, best_rev = gain, j, rev
+                if best_at >= 0:
+                    moved = seg[::-1] if best_rev else seg
+                    path = rest[:best_at + 1] + moved + rest[best_at + 1:]
+                    improved = True
+                i += 1
+    return path[1:last + 1]
+